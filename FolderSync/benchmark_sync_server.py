@@ -0,0 +1,514 @@
+"""
+Benchmarks for sync_server.py
+
+Usage:
+    python benchmark_sync_server.py scan [--files 200000] [--path DIR]
+    python benchmark_sync_server.py manifest [--files 200000] [--path DIR]
+    python benchmark_sync_server.py upload [--size-mb 256] [--streams 1,2,4,8] [--stream-mbps 0] [--url URL]
+    python benchmark_sync_server.py delta [--size-mb 64]
+    python benchmark_sync_server.py batch [--files 5000]
+    python benchmark_sync_server.py download [--size-mb 512] [--requests 8] [--concurrency 4] [--servers dev,waitress,gunicorn]
+    python benchmark_sync_server.py load [--connections 50,200,500] [--upload-seconds 5] [--size-kb 256]
+
+Upload benchmarks write into a 'benchmark' folder under the sync base folder.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import socket
+import subprocess
+import importlib.util
+import gzip
+import json
+import hashlib
+import tempfile
+import threading
+import http.client
+import urllib.parse
+import asyncio
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import sync_server
+
+
+def legacy_scan_directory(directory_path):
+    """The original os.walk + relpath + os.stat scanner, kept for comparison"""
+    files_info = []
+    for root, dirs, files in os.walk(directory_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(file_path, directory_path)
+            try:
+                stat = os.stat(file_path)
+                files_info.append({
+                    'path': relative_path.replace('\\', '/'),
+                    'size': stat.st_size,
+                    'modified': stat.st_mtime
+                })
+            except:
+                continue
+    return files_info
+
+
+def create_tree(root, file_count, files_per_dir=200):
+    """Create a synthetic folder tree of small files"""
+    print(f"🏗️ Creating {file_count} files under {root}...")
+    for i in range(file_count):
+        folder = os.path.join(root, f"album_{i // (files_per_dir * 10)}", f"day_{i // files_per_dir}")
+        if i % files_per_dir == 0:
+            os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"IMG_{i:07d}.jpg"), 'wb') as f:
+            f.write(b'x' * (i % 512))
+
+
+def best_of(runs, func, *args):
+    """Return (best seconds, result) over several runs"""
+    best = None
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_scan(args):
+    root = args.path
+    cleanup = False
+    if not root:
+        root = tempfile.mkdtemp(prefix='foldersync_bench_')
+        cleanup = True
+        create_tree(root, args.files)
+
+    try:
+        legacy_time, legacy_files = best_of(args.runs, legacy_scan_directory, root)
+        scandir_time, scandir_files = best_of(args.runs, sync_server.scan_directory, root)
+        parallel_time, parallel_files = best_of(args.runs, sync_server.scan_directory, root,
+                                                False, sync_server.DEFAULT_HASH_ALGORITHM, False, True)
+
+        assert len(legacy_files) == len(scandir_files) == len(parallel_files)
+
+        print(f"📊 {len(legacy_files)} files, best of {args.runs} runs")
+        print(f"  os.walk + os.stat : {legacy_time:.3f}s")
+        print(f"  os.scandir        : {scandir_time:.3f}s ({legacy_time / scandir_time:.1f}x)")
+        print(f"  os.scandir (pool) : {parallel_time:.3f}s ({legacy_time / parallel_time:.1f}x)")
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_manifest(args):
+    root = args.path
+    cleanup = False
+    if not root:
+        root = tempfile.mkdtemp(prefix='foldersync_bench_')
+        cleanup = True
+        create_tree(root, args.files)
+
+    try:
+        files = sync_server.scan_directory(root, include_hash=args.hash)
+        payload = {'folder_path': 'bench', 'files': files, 'total_files': len(files)}
+
+        json_body = json.dumps(payload).encode('utf-8')
+        manifest_body = sync_server.encode_manifest(files)
+        assert len(sync_server.decode_manifest(manifest_body)) == len(files)
+
+        sizes = [
+            ('JSON', len(json_body)),
+            ('JSON + gzip', len(gzip.compress(json_body))),
+            ('FSM1 manifest', len(manifest_body)),
+            ('FSM1 manifest + gzip', len(gzip.compress(manifest_body))),
+        ]
+        print(f"📊 {len(files)} files{' with hashes' if args.hash else ''}")
+        for name, size in sizes:
+            print(f"  {name:<22}: {size / 1024:9.1f} KB ({len(json_body) / size:.1f}x smaller)")
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def start_local_server():
+    """Serve sync_server.app on an ephemeral port in a background thread"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, sync_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def http_request(base_url, method, path, body=None, headers=None):
+    """Send one request and return (status, parsed JSON body)"""
+    url = urllib.parse.urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+
+def throttled(data, bytes_per_second, block_size=256 * 1024):
+    """Yield data in blocks, sleeping to hold a per-stream rate (0 = unlimited)"""
+    start = time.perf_counter()
+    for position in range(0, len(data), block_size):
+        yield data[position:position + block_size]
+        if bytes_per_second:
+            ahead = (position + block_size) / bytes_per_second - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def bench_upload(args):
+    server = None
+    base_url = args.url
+    if not base_url:
+        server, base_url = start_local_server()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    rate = args.stream_mbps * 1024 * 1024 / 8
+    print(f"📤 Uploading {args.size_mb} MB to {base_url}"
+          f"{f' with each stream capped at {args.stream_mbps} Mbit/s' if rate else ''}")
+
+    try:
+        for streams in [int(n) for n in args.streams.split(',')]:
+            status, session = http_request(base_url, 'POST', '/api/upload/sessions', json.dumps({
+                'folder_path': 'benchmark',
+                'original_filename': f'upload_{streams}_streams.bin',
+                'size': len(data),
+                'sync_mode': 'MIRROR'
+            }), {'Content-Type': 'application/json'})
+            upload_id = session['upload_id']
+
+            chunk_size = -(-len(data) // streams)
+            chunks = [(offset, data[offset:offset + chunk_size]) for offset in range(0, len(data), chunk_size)]
+
+            def send(chunk):
+                offset, body = chunk
+                digest = hashlib.md5(body).hexdigest()
+                status, _ = http_request(base_url, 'PUT', f'/api/upload/sessions/{upload_id}?offset={offset}',
+                                         throttled(body, rate), {
+                                             'Content-Length': str(len(body)),
+                                             'X-Chunk-Hash': digest
+                                         })
+                assert status == 200, status
+                return {'offset': offset, 'length': len(body), 'hash': digest}
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=streams) as executor:
+                digests = list(executor.map(send, chunks))
+            status, result = http_request(base_url, 'POST', f'/api/upload/sessions/{upload_id}/commit',
+                                          json.dumps({'chunks': digests}), {'Content-Type': 'application/json'})
+            elapsed = time.perf_counter() - start
+            assert status == 200, result
+
+            print(f"  {streams} stream(s): {elapsed:.2f}s, {len(data) / elapsed / 1024 / 1024:.1f} MB/s")
+    finally:
+        if server:
+            server.shutdown()
+
+
+def bench_delta(args):
+    root = tempfile.mkdtemp(prefix='foldersync_bench_')
+    try:
+        basis = os.urandom(args.size_mb * 1024 * 1024)
+        middle = len(basis) // 2
+        edits = [
+            ('unchanged', basis),
+            ('appended 64 KB', basis + os.urandom(64 * 1024)),
+            ('inserted 100 bytes', basis[:middle] + os.urandom(100) + basis[middle:]),
+            ('overwrote 1 MB', basis[:middle] + os.urandom(1024 * 1024) + basis[middle + 1024 * 1024:]),
+        ]
+        basis_path = os.path.join(root, 'basis.bin')
+        with open(basis_path, 'wb') as f:
+            f.write(basis)
+        block_size = sync_server.delta_block_size(len(basis))
+        signature = sync_server.file_signature(basis_path, block_size)
+
+        print(f"📊 {args.size_mb} MB file, {block_size} byte blocks, signature {len(json.dumps(signature)) / 1024:.1f} KB")
+        for name, data in edits:
+            new_path = os.path.join(root, 'new.bin')
+            with open(new_path, 'wb') as f:
+                f.write(data)
+            start = time.perf_counter()
+            delta_size = sum(len(chunk) for chunk in sync_server.generate_delta(new_path, signature, block_size))
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<20}: {delta_size / 1024:9.1f} KB sent instead of {len(data) / 1024 / 1024:.0f} MB "
+                  f"({len(data) / delta_size:.0f}x less) in {elapsed:.2f}s")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(home, script=None, **env):
+    """Run a server script as a subprocess with HOME pointed at home, returning (process, base_url)"""
+    port = free_port()
+    env = dict(os.environ, HOME=home, USERPROFILE=home, FOLDERSYNC_PORT=str(port), **env)
+    server = subprocess.Popen([sys.executable, script or os.path.abspath(sync_server.__file__)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            http_request(base_url, 'GET', '/api/health')
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server, base_url
+
+
+def download(base_url, path):
+    """GET a URL and discard the body, returning the byte count"""
+    url = urllib.parse.urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        assert response.status == 200, response.status
+        total = 0
+        while True:
+            chunk = response.read(1024 * 1024)
+            if not chunk:
+                return total
+            total += len(chunk)
+    finally:
+        connection.close()
+
+
+def bench_download(args):
+    home = tempfile.mkdtemp(prefix='foldersync_bench_')
+    try:
+        folder = os.path.join(home, 'Desktop', 'SyncFolders', 'benchmark')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'download.bin'), 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        path = '/api/download/download.bin?folder_path=benchmark'
+        total_mb = args.size_mb * args.requests
+
+        print(f"📥 {args.requests} downloads of {args.size_mb} MB, {args.concurrency} at a time")
+        for mode in args.servers.split(','):
+            if mode != 'dev' and importlib.util.find_spec(mode) is None:
+                print(f"  {mode:<9}: not installed, skipped")
+                continue
+
+            server, base_url = spawn_server(home, FOLDERSYNC_SERVER=mode)
+            try:
+                download(base_url, path)  # Warm the page cache and let the server finish starting
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    received = sum(executor.map(lambda _: download(base_url, path), range(args.requests)))
+                elapsed = time.perf_counter() - start
+                assert received == total_mb * 1024 * 1024
+            finally:
+                server.terminate()
+
+            # wait4 reports the CPU the server (and any workers it reaped) used
+            if hasattr(os, 'wait4'):
+                _, _, usage = os.wait4(server.pid, 0)
+                cpu = f"{usage.ru_utime + usage.ru_stime:.2f}s CPU ({(usage.ru_utime + usage.ru_stime) / total_mb * 1024:.2f}s per GB)"
+            else:
+                server.wait()
+                cpu = 'CPU n/a'
+            print(f"  {mode:<9}: {total_mb / elapsed:8.1f} MB/s, {cpu}")
+        print("  (server CPU includes startup and the warm-up download)")
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def bench_batch(args):
+    server, base_url = start_local_server()
+    folder = os.path.join(sync_server.SYNC_BASE_FOLDER, 'benchmark', 'batch')
+    try:
+        create_tree(folder, args.files)
+        paths = [os.path.relpath(os.path.join(root, name), folder).replace('\\', '/')
+                 for root, _, names in os.walk(folder) for name in names]
+        folder_path = 'benchmark/batch'
+
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(base_url)
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+        for path in paths:
+            connection.request('GET', f"/api/download/{urllib.parse.quote(path)}?folder_path={urllib.parse.quote(folder_path)}")
+            response = connection.getresponse()
+            assert response.status == 200, response.status
+            response.read()
+        connection.close()
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+        connection.request('POST', '/api/download/batch', json.dumps({'folder_path': folder_path, 'paths': paths}),
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        tar_size = len(response.read())
+        connection.close()
+        batch_time = time.perf_counter() - start
+
+        print(f"📊 {len(paths)} small files, requests sent one after another")
+        print(f"  one request per file : {single_time:.2f}s ({len(paths) / single_time:.0f} files/s)")
+        print(f"  /api/download/batch  : {batch_time:.2f}s ({len(paths) / batch_time:.0f} files/s, "
+              f"{single_time / batch_time:.0f}x, {tar_size / 1024:.0f} KB tar)")
+    finally:
+        server.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+async def slow_upload(port, index, payload, upload_seconds, pieces=50):
+    """POST payload to /api/upload/stream in pieces spread over upload_seconds, like a phone on weak Wi-Fi"""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return False
+    try:
+        writer.write((f"POST /api/upload/stream?folder_path=benchmark/load&original_filename=load_{index}.bin HTTP/1.1\r\n"
+                      f"Host: 127.0.0.1\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n").encode())
+        piece = -(-len(payload) // pieces)
+        for position in range(0, len(payload), piece):
+            writer.write(payload[position:position + piece])
+            await writer.drain()
+            await asyncio.sleep(upload_seconds / pieces)
+        status_line = await asyncio.wait_for(reader.readline(), 60)
+        return status_line.split()[1:2] == [b'200']
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+async def health_latency(port):
+    """Seconds for one GET /api/health on a new connection, or None if it failed"""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 10)
+        writer.write(b"GET /api/health HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+        await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+    except (OSError, asyncio.TimeoutError):
+        return None
+    return time.perf_counter() - start
+
+
+def process_usage(pid):
+    """(threads, RSS in MB) of a process from /proc, or (None, None) where that is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['Threads']), int(fields['VmRSS'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+async def load_round(port, pid, connections, payload, upload_seconds):
+    """Hold connections slow uploads open at once, probing /api/health and the server's footprint meanwhile"""
+    uploads = asyncio.gather(*(slow_upload(port, i, payload, upload_seconds) for i in range(connections)))
+    latencies = []
+    threads = rss = 0
+    start = time.perf_counter()
+    while not uploads.done():
+        latency = await health_latency(port)
+        if latency is not None:
+            latencies.append(latency)
+        usage = process_usage(pid)
+        if usage[0] is not None:
+            threads, rss = max(threads, usage[0]), max(rss, usage[1])
+        await asyncio.sleep(0.1)
+    completed = sum(await uploads)
+    return completed, time.perf_counter() - start, latencies, threads, rss
+
+
+def bench_load(args):
+    home = tempfile.mkdtemp(prefix='foldersync_bench_')
+    payload = os.urandom(args.size_kb * 1024)
+    servers = [('threaded', None, {'FOLDERSYNC_SERVER': 'dev'}),
+               ('asyncio', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sync_server_async.py'), {})]
+    try:
+        os.makedirs(os.path.join(home, 'Desktop', 'SyncFolders', 'benchmark', 'load'))
+        print(f"📶 Concurrent slow uploads of {args.size_kb} KB, each spread over {args.upload_seconds}s")
+        for name, script, env in servers:
+            if script and any(importlib.util.find_spec(module) is None for module in ('uvicorn', 'starlette', 'a2wsgi')):
+                print(f"  {name:<8}: uvicorn, starlette and a2wsgi are needed, skipped")
+                continue
+            server, base_url = spawn_server(home, script, **env)
+            port = urllib.parse.urlsplit(base_url).port
+            try:
+                idle_threads, idle_rss = process_usage(server.pid)
+                print(f"  {name} server (idle: {idle_threads} threads, {idle_rss or 0:.0f} MB RSS)")
+                for connections in [int(n) for n in args.connections.split(',')]:
+                    completed, elapsed, latencies, threads, rss = asyncio.run(
+                        load_round(port, server.pid, connections, payload, args.upload_seconds))
+                    if latencies:
+                        latencies.sort()
+                        health = (f"health p50 {statistics.median(latencies) * 1000:6.1f} ms, "
+                                  f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.1f} ms")
+                    else:
+                        health = "health never answered"
+                    footprint = f"{threads} threads, {rss:.0f} MB RSS" if threads else "footprint n/a"
+                    print(f"    {connections:>5} connections: {completed:>5} ok in {elapsed:5.1f}s, {health}, peak {footprint}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Folder Sync Server benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help='Compare directory scanners')
+    scan_parser.add_argument('--files', type=int, default=200000, help='Synthetic tree size')
+    scan_parser.add_argument('--path', help='Scan an existing folder instead')
+    scan_parser.add_argument('--runs', type=int, default=3)
+    scan_parser.set_defaults(func=bench_scan)
+
+    manifest_parser = subparsers.add_parser('manifest', help='Compare scan payload encodings')
+    manifest_parser.add_argument('--files', type=int, default=200000, help='Synthetic tree size')
+    manifest_parser.add_argument('--path', help='Encode an existing folder instead')
+    manifest_parser.add_argument('--hash', action='store_true', help='Include MD5 hashes')
+    manifest_parser.set_defaults(func=bench_manifest)
+
+    upload_parser = subparsers.add_parser('upload', help='Per-file throughput vs parallel chunk streams')
+    upload_parser.add_argument('--size-mb', type=int, default=256)
+    upload_parser.add_argument('--streams', default='1,2,4,8')
+    upload_parser.add_argument('--stream-mbps', type=float, default=0,
+                               help='Cap each stream, e.g. 200 to mimic one Wi-Fi TCP flow (0 = no cap)')
+    upload_parser.add_argument('--url', help='Benchmark a running server instead of an in-process one')
+    upload_parser.set_defaults(func=bench_upload)
+
+    delta_parser = subparsers.add_parser('delta', help='Delta size vs full transfer for small edits')
+    delta_parser.add_argument('--size-mb', type=int, default=64)
+    delta_parser.set_defaults(func=bench_delta)
+
+    batch_parser = subparsers.add_parser('batch', help='Per-file downloads vs one batch tar')
+    batch_parser.add_argument('--files', type=int, default=5000)
+    batch_parser.set_defaults(func=bench_batch)
+
+    download_parser = subparsers.add_parser('download', help='Download throughput and CPU per server mode')
+    download_parser.add_argument('--size-mb', type=int, default=512)
+    download_parser.add_argument('--requests', type=int, default=8)
+    download_parser.add_argument('--concurrency', type=int, default=4)
+    download_parser.add_argument('--servers', default='dev,waitress,gunicorn')
+    download_parser.set_defaults(func=bench_download)
+
+    load_parser = subparsers.add_parser('load', help='Concurrent slow uploads: threaded vs asyncio server')
+    load_parser.add_argument('--connections', default='50,200,500')
+    load_parser.add_argument('--upload-seconds', type=float, default=5)
+    load_parser.add_argument('--size-kb', type=int, default=256)
+    load_parser.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,9 +2,22 @@ import os
 import json
 import time
 import hashlib
-from flask import Flask, request, jsonify, send_from_directory
+import sqlite3
+import shutil
+import uuid
+import gzip
+import zlib
+import mmap
+import math
+import mimetypes
+import tarfile
+import heapq
+import urllib.parse
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import threading
+import stat as stat_module
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 
 app = Flask(__name__)
@@ -23,8 +36,277 @@ if not os.path.exists(SYNC_BASE_FOLDER):
 sync_status = {}
 sync_lock = threading.Lock()
 
-# Hash cache
+# Hash algorithms - md5 stays the default for existing Android clients,
+# faster ones are negotiated through /api/health
+HASH_ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+}
+try:
+    import xxhash
+    HASH_ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+except ImportError:
+    pass
+try:
+    import blake3
+    HASH_ALGORITHMS['blake3'] = blake3.blake3
+except ImportError:
+    pass
+
+DEFAULT_HASH_ALGORITHM = 'md5'
+# Per-folder overrides from FOLDERSYNC_HASH_ALGORITHMS, e.g. 'Videos=xxh3_128,Music=blake2b'
+FOLDER_HASH_ALGORITHMS = {}
+for override in os.environ.get('FOLDERSYNC_HASH_ALGORITHMS', '').split(','):
+    folder, _, algorithm = override.strip().rpartition('=')
+    if not folder:
+        continue
+    if algorithm in HASH_ALGORITHMS:
+        FOLDER_HASH_ALGORITHMS[folder.strip()] = algorithm
+    else:
+        print(f"⚠️ Ignoring hash algorithm '{algorithm}' for '{folder}': not available")
+
+def resolve_hash_algorithm(folder_path, requested=None):
+    """Pick the hash algorithm for a folder, honouring a client request"""
+    algorithm = requested or FOLDER_HASH_ALGORITHMS.get(folder_path, DEFAULT_HASH_ALGORITHM)
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+    return algorithm
+
+# Hash cache keyed by (path, algorithm), mirrored to an on-disk index so it survives restarts.
+# hash_cache_dirs maps each directory to the cached paths directly inside it,
+# so invalidating a folder never walks the whole cache
 hash_cache = {}
+hash_cache_dirs = {}
+hash_cache_lock = threading.Lock()
+
+def cache_hash_entry(path, algorithm, entry):
+    """Add an entry to hash_cache and hash_cache_dirs (caller holds hash_cache_lock)"""
+    hash_cache[(path, algorithm)] = entry
+    hash_cache_dirs.setdefault(os.path.dirname(path), set()).add(path)
+
+def cached_hash_keys(path):
+    """hash_cache keys held for a path, full and quick (caller holds hash_cache_lock)"""
+    return [key for algorithm in HASH_ALGORITHMS
+            for key in ((path, algorithm), (path, QUICK_HASH_PREFIX + algorithm)) if key in hash_cache]
+
+def uncache_hash_path(path):
+    """Drop every algorithm's entry for a path (caller holds hash_cache_lock)"""
+    for key in cached_hash_keys(path):
+        del hash_cache[key]
+    paths = hash_cache_dirs.get(os.path.dirname(path))
+    if paths is not None:
+        paths.discard(path)
+        if not paths:
+            del hash_cache_dirs[os.path.dirname(path)]
+
+def cached_paths_under(directory):
+    """Cached paths anywhere below a directory (caller holds hash_cache_lock)"""
+    prefix = directory.rstrip(os.sep) + os.sep
+    return [path for folder, paths in hash_cache_dirs.items()
+            if folder == directory or folder.startswith(prefix) for path in paths]
+
+# Server state (hash index etc.) lives in a hidden folder that scans skip
+STATE_FOLDER_NAME = '.foldersync'
+PARTIAL_UPLOAD_SUFFIX = '.foldersync-part'  # In-progress streamed uploads, hidden from scans
+STATE_FOLDER = os.path.join(SYNC_BASE_FOLDER, STATE_FOLDER_NAME)
+HASH_INDEX_PATH = os.path.join(STATE_FOLDER, 'hash_index.db')
+HASH_INDEX_VERSION = 2
+os.makedirs(STATE_FOLDER, exist_ok=True)
+
+hash_index_db = None
+hash_index_lock = threading.Lock()
+
+def open_hash_index():
+    """Open the persistent hash index and bulk load it into hash_cache"""
+    global hash_index_db
+    try:
+        hash_index_db = sqlite3.connect(HASH_INDEX_PATH, check_same_thread=False)
+        hash_index_db.execute('PRAGMA journal_mode=WAL')
+        hash_index_db.execute('PRAGMA synchronous=NORMAL')
+        
+        # The index is only a cache, so older layouts are simply rebuilt
+        version = hash_index_db.execute('PRAGMA user_version').fetchone()[0]
+        if version != HASH_INDEX_VERSION:
+            hash_index_db.execute('DROP TABLE IF EXISTS file_hashes')
+            hash_index_db.execute(f'PRAGMA user_version = {HASH_INDEX_VERSION}')
+        
+        hash_index_db.execute('''
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                modified REAL NOT NULL,
+                inode INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (path, algorithm)
+            )
+        ''')
+        hash_index_db.execute('CREATE INDEX IF NOT EXISTS file_hashes_hash ON file_hashes (algorithm, hash)')
+        
+        # Change journal - ordered per-folder change records plus the snapshot
+        # of each tracked folder that reconciliation diffs against
+        hash_index_db.execute('''
+            CREATE TABLE IF NOT EXISTS change_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                folder TEXT NOT NULL,
+                op TEXT NOT NULL,
+                path TEXT NOT NULL,
+                old_path TEXT,
+                size INTEGER,
+                modified REAL,
+                timestamp REAL NOT NULL
+            )
+        ''')
+        hash_index_db.execute('CREATE INDEX IF NOT EXISTS change_journal_folder ON change_journal (folder, seq)')
+        hash_index_db.execute('''
+            CREATE TABLE IF NOT EXISTS journal_folders (
+                folder TEXT PRIMARY KEY,
+                base_seq INTEGER NOT NULL,
+                reconciled_at REAL NOT NULL
+            )
+        ''')
+        hash_index_db.execute('''
+            CREATE TABLE IF NOT EXISTS folder_snapshots (
+                folder TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                modified REAL NOT NULL,
+                PRIMARY KEY (folder, path)
+            )
+        ''')
+        hash_index_db.commit()
+        
+        loaded = 0
+        with hash_cache_lock:
+            for path, algorithm, size, modified, inode, hash_value in hash_index_db.execute(
+                    'SELECT path, algorithm, size, modified, inode, hash FROM file_hashes'):
+                cache_hash_entry(path, algorithm, {
+                    'hash': hash_value, 'algorithm': algorithm, 'modified': modified, 'size': size, 'inode': inode
+                })
+                loaded += 1
+        print(f"🗂️ Loaded {loaded} cached hashes from {HASH_INDEX_PATH}")
+    except Exception as e:
+        print(f"⚠️ Hash index unavailable, using memory-only cache: {e}")
+        hash_index_db = None
+
+def store_file_hash(file_path, stat, hash_value, algorithm=DEFAULT_HASH_ALGORITHM):
+    """Record a hash in the memory cache and the persistent index"""
+    store_file_hashes([(file_path, stat, hash_value, algorithm)])
+
+def store_file_hashes(records):
+    """Record many (file_path, stat, hash, algorithm) tuples in one index transaction"""
+    with hash_cache_lock:
+        for file_path, stat, hash_value, algorithm in records:
+            cache_hash_entry(file_path, algorithm, {
+                'hash': hash_value, 'algorithm': algorithm,
+                'modified': stat.st_mtime, 'size': stat.st_size, 'inode': stat.st_ino
+            })
+    
+    if hash_index_db is None or not records:
+        return
+    try:
+        with hash_index_lock:
+            hash_index_db.executemany(
+                'INSERT OR REPLACE INTO file_hashes (path, algorithm, size, modified, inode, hash) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(file_path, algorithm, stat.st_size, stat.st_mtime, stat.st_ino, hash_value)
+                 for file_path, stat, hash_value, algorithm in records])
+            hash_index_db.commit()
+    except Exception as e:
+        print(f"⚠️ Could not persist hash for {records[0][0]}: {e}")
+
+def invalidate_file_hash(file_path, directory=None):
+    """Drop cached hashes for a file, or for everything under a directory
+    
+    directory defaults to whether file_path is a directory on disk (or still
+    has cached children); pass it when the path has already been moved away.
+    """
+    prefix = file_path.rstrip(os.sep) + os.sep
+    with hash_cache_lock:
+        if directory is None:
+            directory = os.path.isdir(file_path) or file_path in hash_cache_dirs
+        uncache_hash_path(file_path)
+        if directory:
+            for path in cached_paths_under(file_path):
+                uncache_hash_path(path)
+    
+    if hash_index_db is None:
+        return
+    try:
+        with hash_index_lock:
+            hash_index_db.execute('DELETE FROM file_hashes WHERE path = ?', (file_path,))
+            if directory:
+                # A range on the primary key, so only the directory's rows are visited
+                prefix_end = prefix[:-1] + chr(ord(os.sep) + 1)
+                hash_index_db.execute('DELETE FROM file_hashes WHERE path >= ? AND path < ?',
+                                      (prefix, prefix_end))
+            hash_index_db.commit()
+    except Exception as e:
+        print(f"⚠️ Could not update hash index for {file_path}: {e}")
+
+open_hash_index()
+
+# Content-addressed dedup - 'clone' shares extents via reflink where the
+# filesystem supports it (copying otherwise), 'hardlink' links identical files
+# together (edits to one then show up in all of them)
+DEDUP_MODE = os.environ.get('FOLDERSYNC_DEDUP', 'off').lower()
+FICLONE = 0x40049409  # Linux ioctl, supported on btrfs and XFS
+
+def find_files_by_hash(hash_value, algorithm=DEFAULT_HASH_ALGORITHM, size=None):
+    """List files under SYNC_BASE_FOLDER whose cached hash is still valid"""
+    hash_value = hash_value.lower()
+    if hash_index_db is not None:
+        with hash_index_lock:
+            candidates = [row[0] for row in hash_index_db.execute(
+                'SELECT path FROM file_hashes WHERE algorithm = ? AND hash = ?', (algorithm, hash_value))]
+    else:
+        with hash_cache_lock:
+            candidates = [key[0] for key, entry in hash_cache.items()
+                          if key[1] == algorithm and entry['hash'] == hash_value]
+    
+    base_prefix = os.path.abspath(SYNC_BASE_FOLDER) + os.sep
+    state_prefix = os.path.abspath(STATE_FOLDER) + os.sep
+    matches = []
+    for path in candidates:
+        if not path.startswith(base_prefix) or path.startswith(state_prefix):
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if size is not None and stat.st_size != size:
+            continue
+        if get_cached_hash(path, stat, algorithm) == hash_value:
+            matches.append(path)
+    return matches
+
+def find_file_by_hash(hash_value, algorithm=DEFAULT_HASH_ALGORITHM, size=None):
+    """Find one file under SYNC_BASE_FOLDER with the given content"""
+    matches = find_files_by_hash(hash_value, algorithm, size)
+    return matches[0] if matches else None
+
+def share_file(source, destination, hardlink=True):
+    """Create destination sharing source's storage, False if the filesystem can't
+    
+    hardlink=False only tries a reflink, for copies that must stay independent
+    files whatever FOLDERSYNC_DEDUP is set to.
+    """
+    if hardlink and DEDUP_MODE == 'hardlink':
+        try:
+            os.link(source, destination)
+            return True
+        except OSError:
+            pass
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (ImportError, OSError):
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False
 
 def create_safe_filename(filename):
     """Create a safe filename that preserves spaces and most special characters"""
@@ -53,54 +335,856 @@ def create_safe_filename(filename):
     safe_filename = '/'.join(safe_parts) if safe_parts else 'unnamed_file'
     return safe_filename
 
-def get_file_hash(file_path):
-    """Calculate MD5 hash with caching"""
+def get_cached_hash(file_path, stat, algorithm=DEFAULT_HASH_ALGORITHM):
+    """Return the cached hash if size, mtime and inode still match"""
+    cached = hash_cache.get((file_path, algorithm))
+    if (cached and cached['modified'] == stat.st_mtime and cached['size'] == stat.st_size
+            and cached['inode'] == stat.st_ino):
+        return cached['hash']
+    return None
+
+def compute_file_hash(file_path, algorithm=DEFAULT_HASH_ALGORITHM):
+    """Read a whole file through the hash algorithm, bypassing the cache"""
+    hasher = HASH_ALGORITHMS[algorithm]()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def get_file_hash(file_path, stat=None, algorithm=DEFAULT_HASH_ALGORITHM):
+    """Calculate a file hash (MD5 by default) with caching"""
     try:
-        stat = os.stat(file_path)
-        cache_key = file_path
+        file_path = os.path.abspath(file_path)
+        if stat is None:
+            stat = os.stat(file_path)
         
-        if cache_key in hash_cache:
-            cached = hash_cache[cache_key]
-            if cached['modified'] == stat.st_mtime and cached['size'] == stat.st_size:
-                return cached['hash']
+        cached_hash = get_cached_hash(file_path, stat, algorithm)
+        if cached_hash:
+            return cached_hash
         
-        hash_md5 = hashlib.md5()
+        hash_value = compute_file_hash(file_path, algorithm)
+        store_file_hash(file_path, stat, hash_value, algorithm)
+        return hash_value
+    except:
+        return None
+
+# Quick hashes digest the size plus head/middle/tail blocks - enough to spot
+# a changed multi-GB video without reading it all
+QUICK_HASH_BLOCK_SIZE = 65536
+QUICK_HASH_PREFIX = 'quick:'
+MTIME_TOLERANCE = 2.0  # Same 2 second window the Android client uses
+
+def get_quick_hash(file_path, stat=None, algorithm=DEFAULT_HASH_ALGORITHM):
+    """Calculate a sampled hash of size + head/middle/tail blocks with caching"""
+    try:
+        file_path = os.path.abspath(file_path)
+        if stat is None:
+            stat = os.stat(file_path)
+        
+        cache_algorithm = QUICK_HASH_PREFIX + algorithm
+        cached_hash = get_cached_hash(file_path, stat, cache_algorithm)
+        if cached_hash:
+            return cached_hash
+        
+        size = stat.st_size
+        hasher = HASH_ALGORITHMS[algorithm]()
+        hasher.update(str(size).encode())
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(65536), b""):
-                hash_md5.update(chunk)
+            if size <= QUICK_HASH_BLOCK_SIZE * 3:
+                hasher.update(f.read())
+            else:
+                for offset in (0, (size - QUICK_HASH_BLOCK_SIZE) // 2, size - QUICK_HASH_BLOCK_SIZE):
+                    f.seek(offset)
+                    hasher.update(f.read(QUICK_HASH_BLOCK_SIZE))
         
-        hash_value = hash_md5.hexdigest()
-        hash_cache[cache_key] = {'hash': hash_value, 'modified': stat.st_mtime, 'size': stat.st_size}
+        hash_value = hasher.hexdigest()
+        store_file_hash(file_path, stat, hash_value, cache_algorithm)
         return hash_value
     except:
         return None
 
-def scan_directory(directory_path, include_hash=False):
-    """Scan directory - hash optional for speed"""
-    files_info = []
+# Parallel hashing - hashlib releases the GIL on large buffers, so threads
+# spread MD5 work across cores while per-device semaphores cap disk I/O
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+HASH_IO_PER_DEVICE = 4
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='hash')
+device_semaphores = {}
+device_semaphores_lock = threading.Lock()
+
+def get_device_semaphore(device):
+    """Get the semaphore limiting concurrent reads on one storage device"""
+    with device_semaphores_lock:
+        if device not in device_semaphores:
+            device_semaphores[device] = threading.BoundedSemaphore(HASH_IO_PER_DEVICE)
+        return device_semaphores[device]
+
+def hash_file_bounded(file_path, algorithm=DEFAULT_HASH_ALGORITHM, quick=False):
+    """Hash a file, holding its device's I/O slot only when it must be read"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    
+    cache_algorithm = QUICK_HASH_PREFIX + algorithm if quick else algorithm
+    cached_hash = get_cached_hash(os.path.abspath(file_path), stat, cache_algorithm)
+    if cached_hash:
+        return cached_hash
+    
+    with get_device_semaphore(stat.st_dev):
+        if quick:
+            return get_quick_hash(file_path, stat, algorithm)
+        return get_file_hash(file_path, stat, algorithm)
+
+def hash_files_parallel(file_paths, algorithm=DEFAULT_HASH_ALGORITHM, quick=False):
+    """Hash files on the worker pool, yielding (file_path, hash) as each completes"""
+    pending = {}
+    paths = iter(file_paths)
+    max_in_flight = HASH_WORKERS * 4
+    
+    while True:
+        # Keep a bounded window of submitted work so huge batches stay cheap
+        for file_path in paths:
+            pending[hash_executor.submit(hash_file_bounded, file_path, algorithm, quick)] = file_path
+            if len(pending) >= max_in_flight:
+                break
+        
+        if not pending:
+            return
+        
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
+# Scanning - os.scandir reuses directory entry data instead of walking and
+# re-stat'ing every file, and relative paths are built up as we descend
+SCAN_WORKERS = 8
+scan_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='scan')
+
+def scan_tree(directory_path, prefix=''):
+    """Yield (relative_path, full_path, stat) for every file under directory_path"""
+    stack = [(directory_path, prefix)]
+    while stack:
+        current_path, current_prefix = stack.pop()
+        try:
+            with os.scandir(current_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != STATE_FOLDER_NAME:
+                                stack.append((entry.path, current_prefix + entry.name + '/'))
+                        elif entry.is_file() and not entry.name.endswith(PARTIAL_UPLOAD_SUFFIX):
+                            yield current_prefix + entry.name, entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+def scan_tree_parallel(directory_path):
+    """Scan top-level subtrees on the scan pool, yielding the same tuples as scan_tree"""
+    subtrees = []
+    try:
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != STATE_FOLDER_NAME:
+                            subtrees.append(scan_executor.submit(
+                                lambda path, prefix: list(scan_tree(path, prefix)), entry.path, entry.name + '/'))
+                    elif entry.is_file() and not entry.name.endswith(PARTIAL_UPLOAD_SUFFIX):
+                        yield entry.name, entry.path, entry.stat()
+                except OSError:
+                    continue
+    except OSError:
+        return
     
+    for subtree in subtrees:
+        yield from subtree.result()
+
+def iter_directory(directory_path, include_hash=False, algorithm=DEFAULT_HASH_ALGORITHM, quick=False, parallel=False):
+    """Yield file info dicts as files are discovered - hash (full or quick) optional for speed"""
     if not os.path.exists(directory_path):
-        return files_info
+        return
     
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, directory_path)
-            
-            try:
-                stat = os.stat(file_path)
-                file_info = {
-                    'path': relative_path.replace('\\', '/'),
-                    'size': stat.st_size,
-                    'modified': stat.st_mtime
-                }
-                if include_hash:
-                    file_info['hash'] = get_file_hash(file_path)
-                files_info.append(file_info)
-            except:
+    # Serve from the live index when the watcher keeps one for this folder
+    listing = get_live_listing(directory_path)
+    if listing is not None:
+        entries = ((path, os.path.join(directory_path, path), size, modified, None)
+                   for path, (size, modified) in listing)
+    else:
+        tree = scan_tree_parallel(directory_path) if parallel else scan_tree(directory_path)
+        entries = ((path, file_path, stat.st_size, stat.st_mtime, stat) for path, file_path, stat in tree)
+    
+    for relative_path, file_path, size, modified, stat in entries:
+        file_info = {
+            'path': relative_path,
+            'size': size,
+            'modified': modified
+        }
+        if include_hash:
+            if quick:
+                file_info['hash'] = get_quick_hash(file_path, stat, algorithm)
+            else:
+                file_info['hash'] = get_file_hash(file_path, stat, algorithm)
+        yield file_info
+
+def scan_directory(directory_path, include_hash=False, algorithm=DEFAULT_HASH_ALGORITHM, quick=False, parallel=False):
+    """Scan directory - hash (full or quick) optional for speed"""
+    return list(iter_directory(directory_path, include_hash, algorithm, quick, parallel))
+
+# Live folder index - optionally keeps every folder under SYNC_BASE_FOLDER in
+# memory, updated from filesystem events (watchdog) or by periodic polling
+ENABLE_FOLDER_WATCHER = os.environ.get('FOLDERSYNC_WATCH', 'false').lower() == 'true'
+WATCH_POLL_INTERVAL = 10  # Seconds between rescans when watchdog is not installed
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+folder_indexes = {}  # {absolute folder: {relative path: (size, modified)}}
+folder_index_generations = {}  # Bumped on every index change, used to validate derived caches
+folder_index_lock = threading.Lock()
+
+def split_live_path(path):
+    """Map an absolute path to (top-level sync folder, relative path), or (None, None)"""
+    base = os.path.abspath(SYNC_BASE_FOLDER)
+    path = os.path.abspath(path)
+    if not path.startswith(base + os.sep):
+        return None, None
+    
+    parts = path[len(base) + 1:].split(os.sep)
+    if parts[0] == STATE_FOLDER_NAME:
+        return None, None
+    return os.path.join(base, parts[0]), '/'.join(parts[1:])
+
+def build_folder_index(folder):
+    """(Re)build the live index of one top-level folder from disk"""
+    index = {relative_path: (stat.st_size, stat.st_mtime) for relative_path, _, stat in scan_tree(folder)}
+    with folder_index_lock:
+        folder_indexes[folder] = index
+        folder_index_generations[folder] = folder_index_generations.get(folder, 0) + 1
+    return index
+
+def refresh_live_path(path):
+    """Re-stat a changed file or directory and update the live index"""
+    if not folder_indexes:
+        return
+    folder, relative_path = split_live_path(path)
+    if folder is None or path.endswith(PARTIAL_UPLOAD_SUFFIX):
+        return
+    
+    with folder_index_lock:
+        index = folder_indexes.get(folder)
+        folder_index_generations[folder] = folder_index_generations.get(folder, 0) + 1
+    if index is None or not relative_path:
+        if os.path.isdir(folder):
+            if index is None:
+                build_folder_index(folder)
+        else:
+            with folder_index_lock:
+                folder_indexes.pop(folder, None)
+        return
+    
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+    
+    if stat is None:
+        # Gone - drop the file, or everything below a removed directory
+        prefix = relative_path + '/'
+        with folder_index_lock:
+            for key in [k for k in index if k == relative_path or k.startswith(prefix)]:
+                del index[key]
+    elif stat_module.S_ISREG(stat.st_mode):
+        with folder_index_lock:
+            index[relative_path] = (stat.st_size, stat.st_mtime)
+    elif stat_module.S_ISDIR(stat.st_mode):
+        # A directory created or moved in - index everything below it
+        entries = {child: (s.st_size, s.st_mtime) for child, _, s in scan_tree(path, relative_path + '/')}
+        with folder_index_lock:
+            index.update(entries)
+
+def get_live_generation(directory_path):
+    """Return the live index generation covering a path, or None if not indexed"""
+    folder, _ = split_live_path(directory_path)
+    with folder_index_lock:
+        if folder is None or folder not in folder_indexes:
+            return None
+        return folder_index_generations.get(folder, 0)
+
+def get_live_listing(directory_path):
+    """Return [(relative path, (size, modified))] from the live index, or None if not indexed"""
+    folder, relative_path = split_live_path(directory_path)
+    if folder is None:
+        return None
+    
+    with folder_index_lock:
+        index = folder_indexes.get(folder)
+        if index is None:
+            return None
+        if not relative_path:
+            return list(index.items())
+        prefix = relative_path + '/'
+        return [(path[len(prefix):], info) for path, info in index.items() if path.startswith(prefix)]
+
+class LiveIndexHandler(FileSystemEventHandler):
+    """Feeds watchdog events into the live index"""
+    
+    def on_any_event(self, event):
+        # Directory mtime changes are implied by the child events
+        if event.is_directory and event.event_type == 'modified':
+            return
+        refresh_live_path(event.src_path)
+        if getattr(event, 'dest_path', None):
+            refresh_live_path(event.dest_path)
+
+def index_all_folders():
+    """Index every top-level folder and forget folders that no longer exist"""
+    base = os.path.abspath(SYNC_BASE_FOLDER)
+    present = set()
+    for item in os.listdir(base):
+        folder = os.path.join(base, item)
+        if item != STATE_FOLDER_NAME and os.path.isdir(folder):
+            present.add(folder)
+            build_folder_index(folder)
+    with folder_index_lock:
+        for folder in [f for f in folder_indexes if f not in present]:
+            del folder_indexes[folder]
+
+def poll_folder_indexes():
+    """Polling fallback - rescan all folders in the background"""
+    while True:
+        time.sleep(WATCH_POLL_INTERVAL)
+        try:
+            index_all_folders()
+        except Exception as e:
+            print(f"⚠️ Folder poll failed: {e}")
+
+def start_folder_watcher():
+    """Start keeping live folder indexes if FOLDERSYNC_WATCH=true"""
+    if not ENABLE_FOLDER_WATCHER:
+        return
+    
+    if Observer is not None:
+        observer = Observer()
+        observer.schedule(LiveIndexHandler(), SYNC_BASE_FOLDER, recursive=True)
+        observer.daemon = True
+        observer.start()
+        index_all_folders()
+        print(f"👀 Watching {SYNC_BASE_FOLDER} for changes ({len(folder_indexes)} folders indexed)")
+    else:
+        index_all_folders()
+        threading.Thread(target=poll_folder_indexes, daemon=True).start()
+        print(f"👀 watchdog not installed, polling every {WATCH_POLL_INTERVAL}s ({len(folder_indexes)} folders indexed)")
+
+# Change journal - upload/rename/delete handlers append to it, and a periodic
+# reconciliation pass catches edits made outside the server
+JOURNAL_RETENTION = 7 * 24 * 3600  # Seconds of history kept per folder
+RECONCILE_INTERVAL = 30  # Seconds before /api/scan/changes rescans the disk
+
+def journal_relative_path(target_folder, file_path):
+    """Relative path of a file inside a sync folder, with forward slashes"""
+    return os.path.relpath(file_path, target_folder).replace('\\', '/')
+
+def append_journal_locked(folder, op, path, old_path=None, size=None, modified=None):
+    """Append one change and update the snapshot (hash_index_lock must be held)"""
+    hash_index_db.execute(
+        'INSERT INTO change_journal (folder, op, path, old_path, size, modified, timestamp) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (folder, op, path, old_path, size, modified, time.time()))
+    if old_path is not None:
+        hash_index_db.execute('DELETE FROM folder_snapshots WHERE folder = ? AND path = ?', (folder, old_path))
+    if op == 'deleted':
+        hash_index_db.execute('DELETE FROM folder_snapshots WHERE folder = ? AND path = ?', (folder, path))
+    else:
+        hash_index_db.execute(
+            'INSERT OR REPLACE INTO folder_snapshots (folder, path, size, modified) VALUES (?, ?, ?, ?)',
+            (folder, path, size, modified))
+
+def record_change(target_folder, op, file_path, old_file_path=None):
+    """Journal a change made through the API (op: added, modified, deleted, renamed)"""
+    refresh_live_path(file_path)
+    if old_file_path:
+        refresh_live_path(old_file_path)
+    
+    if hash_index_db is None:
+        return
+    folder = os.path.abspath(target_folder)
+    try:
+        size = modified = None
+        if op != 'deleted':
+            stat = os.stat(file_path)
+            if not os.path.isfile(file_path):
+                # Directory moves touch many files, let reconciliation sort them out
+                mark_folder_stale(folder)
+                return
+            size, modified = stat.st_size, stat.st_mtime
+        
+        path = journal_relative_path(folder, file_path)
+        old_path = journal_relative_path(folder, old_file_path) if old_file_path else None
+        with hash_index_lock:
+            if not hash_index_db.execute('SELECT 1 FROM journal_folders WHERE folder = ?', (folder,)).fetchone():
+                return  # Folder not tracked yet, its first /api/scan/changes call starts the journal
+            append_journal_locked(folder, op, path, old_path, size, modified)
+            hash_index_db.commit()
+    except Exception as e:
+        print(f"⚠️ Could not journal {op} of {file_path}: {e}")
+
+def mark_folder_stale(folder):
+    """Force the next /api/scan/changes on a folder to reconcile with the disk"""
+    if hash_index_db is None:
+        return
+    with hash_index_lock:
+        hash_index_db.execute('UPDATE journal_folders SET reconciled_at = 0 WHERE folder = ?', (folder,))
+        hash_index_db.commit()
+
+def reconcile_folder(target_folder):
+    """Diff the folder on disk against its snapshot and journal the differences"""
+    folder = os.path.abspath(target_folder)
+    # API changes journaled while the disk is walked are newer than the walk
+    with hash_index_lock:
+        walk_seq = hash_index_db.execute('SELECT COALESCE(MAX(seq), 0) FROM change_journal').fetchone()[0]
+    listing = get_live_listing(folder)
+    if listing is not None:
+        on_disk = dict(listing)
+    else:
+        on_disk = {relative_path: (stat.st_size, stat.st_mtime) for relative_path, _, stat in scan_tree(folder)}
+    
+    with hash_index_lock:
+        snapshot = {
+            path: (size, modified) for path, size, modified in hash_index_db.execute(
+                'SELECT path, size, modified FROM folder_snapshots WHERE folder = ?', (folder,))
+        }
+        tracked = hash_index_db.execute('SELECT 1 FROM journal_folders WHERE folder = ?', (folder,)).fetchone()
+        if not tracked:
+            # First reconciliation only builds the snapshot, history starts after it
+            base_seq = hash_index_db.execute('SELECT COALESCE(MAX(seq), 0) FROM change_journal').fetchone()[0]
+            hash_index_db.execute('DELETE FROM folder_snapshots WHERE folder = ?', (folder,))
+            hash_index_db.executemany(
+                'INSERT INTO folder_snapshots (folder, path, size, modified) VALUES (?, ?, ?, ?)',
+                [(folder, path, size, modified) for path, (size, modified) in on_disk.items()])
+            hash_index_db.execute(
+                'INSERT INTO journal_folders (folder, base_seq, reconciled_at) VALUES (?, ?, ?)',
+                (folder, base_seq, time.time()))
+            hash_index_db.commit()
+            return
+        
+        # Their snapshot rows are already current, so the walk must not second-guess them
+        journaled = set()
+        for path, old_path in hash_index_db.execute(
+                'SELECT path, old_path FROM change_journal WHERE folder = ? AND seq > ?', (folder, walk_seq)):
+            journaled.add(path)
+            if old_path is not None:
+                journaled.add(old_path)
+        
+        added = {path: info for path, info in on_disk.items() if path not in snapshot and path not in journaled}
+        deleted = {path: info for path, info in snapshot.items() if path not in on_disk and path not in journaled}
+        modified = [path for path, info in on_disk.items()
+                    if path in snapshot and snapshot[path] != info and path not in journaled]
+        
+        # A file that vanished and reappeared elsewhere with the same size and mtime was renamed
+        renamed = []
+        deleted_by_info = {}
+        for path, info in deleted.items():
+            deleted_by_info.setdefault(info, []).append(path)
+        for path, info in list(added.items()):
+            if deleted_by_info.get(info):
+                old_path = deleted_by_info[info].pop()
+                renamed.append((old_path, path))
+                del added[path]
+                del deleted[old_path]
+        
+        for old_path, path in renamed:
+            append_journal_locked(folder, 'renamed', path, old_path, *on_disk[path])
+        for path in modified:
+            append_journal_locked(folder, 'modified', path, None, *on_disk[path])
+        for path in added:
+            append_journal_locked(folder, 'added', path, None, *on_disk[path])
+        for path in deleted:
+            append_journal_locked(folder, 'deleted', path)
+        
+        now = time.time()
+        hash_index_db.execute('UPDATE journal_folders SET reconciled_at = ? WHERE folder = ?', (now, folder))
+        
+        # Prune old history; clients holding older cursors get a full listing
+        cutoff = hash_index_db.execute(
+            'SELECT MAX(seq) FROM change_journal WHERE folder = ? AND timestamp < ?',
+            (folder, now - JOURNAL_RETENTION)).fetchone()[0]
+        if cutoff:
+            hash_index_db.execute('DELETE FROM change_journal WHERE folder = ? AND seq <= ?', (folder, cutoff))
+            hash_index_db.execute(
+                'UPDATE journal_folders SET base_seq = MAX(base_seq, ?) WHERE folder = ?', (cutoff, folder))
+        hash_index_db.commit()
+    
+    changes = len(renamed) + len(modified) + len(added) + len(deleted)
+    if changes:
+        print(f"🔁 Reconciled {folder}: {changes} out-of-band changes journaled")
+
+# Merkle directory digests - every directory gets a digest over its sorted
+# children, so a client only descends into subtrees whose digests differ.
+# Each directory's result is cached under a fingerprint of its children's
+# stats and subdirectory digests, so repeat calls only re-stat the subtree
+# they ask for and rebuild just the directories that changed.
+tree_digest_cache = {}  # {(directory, mode, algorithm): (fingerprint, info)}
+tree_digest_results = {}  # {(directory, sub_path, depth, mode, algorithm): (live index generation, digests)}
+tree_digest_cache_lock = threading.Lock()
+
+def directory_digest(directory_path, relative, mode, algorithm, depth, out):
+    """Digest info of one directory, adding it and its subdirectories within depth to out"""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != STATE_FOLDER_NAME:
+                            subdirs.append(entry.name)
+                    elif entry.is_file() and not entry.name.endswith(PARTIAL_UPLOAD_SUFFIX):
+                        files.append((entry.name, entry.stat()))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    
+    children = {}
+    for name in subdirs:
+        child = f"{relative}/{name}" if relative else name
+        info = directory_digest(os.path.join(directory_path, name), child, mode, algorithm,
+                                None if depth is None else depth - 1, out)
+        if info['files']:
+            children[name] = info
+    
+    fingerprint = hash((
+        tuple(sorted((name, stat.st_size, stat.st_mtime_ns, stat.st_ino) for name, stat in files)),
+        tuple(sorted((name, info['digest']) for name, info in children.items()))
+    ))
+    cache_key = (directory_path, mode, algorithm)
+    with tree_digest_cache_lock:
+        cached = tree_digest_cache.get(cache_key)
+    if cached and cached[0] == fingerprint:
+        info = cached[1]
+    else:
+        lines = []
+        for name, stat in files:
+            if mode == 'content':
+                detail = get_file_hash(os.path.join(directory_path, name), stat, algorithm) or ''
+            else:
+                detail = str(int(round(stat.st_mtime * 1000)))
+            lines.append((name, f"F{name}\0{stat.st_size}\0{detail}\n"))
+        for name, child_info in children.items():
+            lines.append((name, f"D{name}\0{child_info['digest']}\n"))
+        
+        hasher = HASH_ALGORITHMS[algorithm]()
+        for _, line in sorted(lines):
+            hasher.update(line.encode('utf-8'))
+        info = {
+            'digest': hasher.hexdigest(),
+            'files': len(files) + sum(child_info['files'] for child_info in children.values()),
+            'size': sum(stat.st_size for _, stat in files) + sum(child_info['size'] for child_info in children.values())
+        }
+        with tree_digest_cache_lock:
+            tree_digest_cache[cache_key] = (fingerprint, info)
+    
+    if depth is None or depth >= 0:
+        out[relative] = info
+    return info
+
+def compute_tree_digests(directory_path, mode='stat', algorithm=DEFAULT_HASH_ALGORITHM, sub_path='', depth=None):
+    """Compute {relative dir: {digest, files, size}} for directories holding files under sub_path
+    
+    Only sub_path's subtree is visited, and directories more than depth levels
+    below it are left out of the result (their digests still count). A
+    directory digest hashes its children sorted by name, one line each:
+    files as "F<name>\\0<size>\\0<mtime in ms>\\n" (mode 'stat') or
+    "F<name>\\0<size>\\0<content hash>\\n" (mode 'content'), and
+    subdirectories as "D<name>\\0<digest>\\n". The root directory is ''.
+    """
+    directory_path = os.path.abspath(directory_path)
+    generation = get_live_generation(directory_path)
+    result_key = (directory_path, sub_path, depth, mode, algorithm)
+    if generation is not None:
+        with tree_digest_cache_lock:
+            cached = tree_digest_results.get(result_key)
+        if cached and cached[0] == generation:
+            return cached[1]
+    
+    start_path = os.path.join(directory_path, *sub_path.split('/')) if sub_path else directory_path
+    digests = {}
+    if os.path.isdir(start_path):
+        root_info = directory_digest(start_path, sub_path, mode, algorithm, depth, digests)
+        # Like the root, an empty sub_path is still reported; empty subdirectories are not
+        digests = {path: info for path, info in digests.items() if info['files'] or path == sub_path}
+        digests[sub_path] = root_info
+    
+    if generation is not None:
+        with tree_digest_cache_lock:
+            tree_digest_results[result_key] = (generation, digests)
+    return digests
+
+# Compact manifests - a binary alternative to the JSON file lists negotiated
+# via the Accept header, plus gzip/zstd transport compression
+MANIFEST_MIME_TYPE = 'application/x-foldersync-manifest'
+MANIFEST_MAGIC = b'FSM1'
+MANIFEST_HAS_STAT = 1
+MANIFEST_HAS_HASH = 2
+MANIFEST_HAS_FULL_HASH = 4  # Second digest per file - escalated full hashes in quick mode
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def write_varint(out, value):
+    """Append an unsigned LEB128 varint"""
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos):
+    """Read an unsigned LEB128 varint, returning (value, new position)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def encode_manifest(files):
+    """Encode file entries as a prefix-compressed FSM1 manifest
+    
+    Layout: magic, flags, count, digest length, then per file (sorted by path):
+    shared path prefix length, suffix length, suffix bytes, and depending on
+    flags the size, zigzag mtime delta in milliseconds, and raw digest bytes
+    (preceded by a 0/1 presence byte), then the same for 'full_hash'.
+    """
+    files = sorted(files, key=lambda f: f['path'])
+    flags = 0
+    if files and 'size' in files[0]:
+        flags |= MANIFEST_HAS_STAT
+    if any('hash' in f for f in files):
+        flags |= MANIFEST_HAS_HASH
+    if any('full_hash' in f for f in files):
+        flags |= MANIFEST_HAS_FULL_HASH
+    digest_length = max((len(f[key]) // 2 for f in files for key in ('hash', 'full_hash') if f.get(key)), default=0)
+    
+    out = bytearray(MANIFEST_MAGIC)
+    write_varint(out, flags)
+    write_varint(out, len(files))
+    write_varint(out, digest_length)
+    
+    previous_path = b''
+    previous_mtime = 0
+    for file_info in files:
+        path = file_info['path'].encode('utf-8')
+        shared = 0
+        limit = min(len(path), len(previous_path))
+        while shared < limit and path[shared] == previous_path[shared]:
+            shared += 1
+        write_varint(out, shared)
+        write_varint(out, len(path) - shared)
+        out += path[shared:]
+        previous_path = path
+        
+        if flags & MANIFEST_HAS_STAT:
+            write_varint(out, file_info['size'])
+            mtime = int(round(file_info['modified'] * 1000))
+            delta = mtime - previous_mtime
+            write_varint(out, (delta << 1) if delta >= 0 else ((-delta << 1) - 1))
+            previous_mtime = mtime
+        
+        for flag, key in ((MANIFEST_HAS_HASH, 'hash'), (MANIFEST_HAS_FULL_HASH, 'full_hash')):
+            if flags & flag:
+                if file_info.get(key):
+                    out.append(1)
+                    out += bytes.fromhex(file_info[key])
+                else:
+                    out.append(0)
+    
+    return bytes(out)
+
+def decode_manifest(data):
+    """Decode an FSM1 manifest back into file entry dicts"""
+    if data[:4] != MANIFEST_MAGIC:
+        raise ValueError('Not a FolderSync manifest')
+    flags, pos = read_varint(data, 4)
+    count, pos = read_varint(data, pos)
+    digest_length, pos = read_varint(data, pos)
+    
+    files = []
+    previous_path = b''
+    previous_mtime = 0
+    for _ in range(count):
+        shared, pos = read_varint(data, pos)
+        suffix_length, pos = read_varint(data, pos)
+        path = previous_path[:shared] + data[pos:pos + suffix_length]
+        pos += suffix_length
+        previous_path = path
+        file_info = {'path': path.decode('utf-8')}
+        
+        if flags & MANIFEST_HAS_STAT:
+            file_info['size'], pos = read_varint(data, pos)
+            zigzag, pos = read_varint(data, pos)
+            previous_mtime += (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1)
+            file_info['modified'] = previous_mtime / 1000
+        
+        for flag, key in ((MANIFEST_HAS_HASH, 'hash'), (MANIFEST_HAS_FULL_HASH, 'full_hash')):
+            if flags & flag:
+                present = data[pos]
+                pos += 1
+                if present:
+                    file_info[key] = data[pos:pos + digest_length].hex()
+                    pos += digest_length
+        files.append(file_info)
+    
+    return files
+
+def negotiated_response(payload, files_key):
+    """Encode a file-list response as the client's Accept header asks, then compress it"""
+    accept = request.headers.get('Accept', '')
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    
+    if MANIFEST_MIME_TYPE in accept:
+        # Only the file list goes in the body, the rest travels in headers
+        body = encode_manifest(payload[files_key])
+        mimetype = MANIFEST_MIME_TYPE
+    elif 'application/msgpack' in accept and msgpack is not None:
+        body = msgpack.packb(payload)
+        mimetype = 'application/msgpack'
+    else:
+        body = json.dumps(payload).encode('utf-8')
+        mimetype = 'application/json'
+    
+    content_encoding = None
+    if len(body) > 1024:
+        if 'zstd' in accept_encoding and zstandard is not None:
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+            content_encoding = 'zstd'
+        elif 'gzip' in accept_encoding:
+            body = gzip.compress(body, compresslevel=6)
+            content_encoding = 'gzip'
+    
+    response = Response(body, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    if mimetype == MANIFEST_MIME_TYPE:
+        for key, value in payload.items():
+            if key != files_key:
+                # Percent-encoded so non-ASCII folder names survive the header
+                response.headers['X-FolderSync-' + key.replace('_', '-').title()] = urllib.parse.quote(str(value))
+    return response
+
+# Progress events - Server-Sent Events streams for sync jobs, upload sessions
+# and any upload or batch download tagged with a progress id. A channel keeps
+# only its latest state, and a subscriber sends at most one event per
+# PROGRESS_MIN_INTERVAL, so bursts of updates coalesce into the newest one.
+PROGRESS_MIN_INTERVAL = 0.25
+PROGRESS_KEEPALIVE = 15  # Seconds between comment lines on an idle stream
+PROGRESS_CHANNEL_TTL = 300  # Idle channels without subscribers are dropped after this
+PROGRESS_FINAL_EVENTS = ('completed', 'error', 'cancelled', 'committed', 'done')
+# Each open stream holds a server thread, so only a quarter of the SERVER_THREADS
+# pool may be watching - beyond that clients get 503 and a status route to poll
+PROGRESS_MAX_STREAMS = 8
+progress_stream_slots = threading.BoundedSemaphore(PROGRESS_MAX_STREAMS)
+
+progress_channels = {}
+progress_lock = threading.Lock()
+
+def get_progress_channel(name):
+    """Return the channel for a name, creating it (and expiring idle ones) as needed"""
+    with progress_lock:
+        channel = progress_channels.get(name)
+        if channel is None:
+            cutoff = time.time() - PROGRESS_CHANNEL_TTL
+            for stale in [key for key, value in progress_channels.items()
+                          if value['subscribers'] == 0 and value['updated'] < cutoff]:
+                del progress_channels[stale]
+            channel = progress_channels[name] = {
+                'cond': threading.Condition(), 'version': 0, 'event': None, 'data': None,
+                'updated': time.time(), 'subscribers': 0
+            }
+        return channel
+
+def publish_progress(name, event, data):
+    """Replace a channel's state and wake its subscribers"""
+    channel = get_progress_channel(name)
+    with channel['cond']:
+        channel['version'] += 1
+        channel['event'] = event
+        channel['data'] = data
+        channel['updated'] = time.time()
+        channel['cond'].notify_all()
+
+def progress_event_stream(name):
+    """Yield SSE messages for a channel until a final event is sent"""
+    channel = get_progress_channel(name)
+    with channel['cond']:
+        channel['subscribers'] += 1
+    seen = 0
+    try:
+        yield ': connected\n\n'  # Sends the headers now rather than with the first event
+        while True:
+            with channel['cond']:
+                channel['cond'].wait_for(lambda: channel['version'] != seen, timeout=PROGRESS_KEEPALIVE)
+                changed = channel['version'] != seen
+                seen, event, data = channel['version'], channel['event'], channel['data']
+            if not changed:
+                yield ': keepalive\n\n'
                 continue
+            yield f"id: {seen}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            if event in PROGRESS_FINAL_EVENTS:
+                return
+            time.sleep(PROGRESS_MIN_INTERVAL)
+    finally:
+        with channel['cond']:
+            channel['subscribers'] -= 1
+
+def progress_response(name, poll_url=None):
+    """Wrap a channel's event stream in a text/event-stream response, or 503 when all stream slots are taken"""
+    if not progress_stream_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many progress streams open, poll instead', 'poll_url': poll_url})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    
+    released = threading.Event()
+    def release_slot():
+        # close() may come more than once, or without the stream ever starting
+        if not released.is_set():
+            released.set()
+            progress_stream_slots.release()
     
-    return files_info
+    response = Response(stream_with_context(progress_event_stream(name)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(release_slot)
+    return response
+
+def request_progress_id():
+    """Client-chosen progress id of this request (X-Progress-Id header or progress_id query parameter)"""
+    return request.headers.get('X-Progress-Id') or request.args.get('progress_id')
+
+def transfer_progress(progress_id, total=None):
+    """Callback publishing a byte count on progress/<progress_id>, or None without an id"""
+    if not progress_id:
+        return None
+    return lambda done: publish_progress(f"progress/{progress_id}", 'progress', {'bytes': done, 'total': total})
+
+@app.route('/api/progress/<progress_id>/events')
+def progress_events(progress_id):
+    """SSE progress of an upload or batch download sent with this progress id"""
+    return progress_response(f"progress/{progress_id}")
 
 @app.route('/api/folders', methods=['GET'])
 def get_folders():
@@ -108,6 +1192,8 @@ def get_folders():
     try:
         folders = []
         for item in os.listdir(SYNC_BASE_FOLDER):
+            if item == STATE_FOLDER_NAME:
+                continue
             item_path = os.path.join(SYNC_BASE_FOLDER, item)
             if os.path.isdir(item_path):
                 folders.append({
@@ -160,7 +1246,36 @@ def scan_folder():
             os.makedirs(full_path, exist_ok=True)
             print(f"✅ Created folder: {full_path}")
         
-        files_info = scan_directory(full_path)
+        include_hash = data.get('include_hash', False)
+        quick = data.get('hash_mode', 'full') == 'quick'
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        parallel = data.get('parallel', False)
+        
+        # Streaming mode sends one JSON line per file as the scanner finds it,
+        # followed by a summary line, so memory stays flat on huge folders
+        stream = data.get('stream', False) or 'application/x-ndjson' in request.headers.get('Accept', '')
+        if stream:
+            def generate():
+                total_files = 0
+                lines = []
+                for file_info in iter_directory(full_path, include_hash, algorithm, quick, parallel):
+                    total_files += 1
+                    lines.append(json.dumps(file_info) + '\n')
+                    if len(lines) >= 256:  # Batch lines to avoid one socket write per file
+                        yield ''.join(lines)
+                        lines = []
+                if lines:
+                    yield ''.join(lines)
+                print(f"📊 Streamed {total_files} files")
+                yield json.dumps({'done': True, 'folder_path': folder_path, 'total_files': total_files}) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        files_info = scan_directory(full_path, include_hash, algorithm, quick, parallel)
         print(f"📊 Found {len(files_info)} files")
         
         # Log some file details for debugging
@@ -169,38 +1284,222 @@ def scan_folder():
         if len(files_info) > 3:
             print(f"  ... and {len(files_info) - 3} more files")
         
-        return jsonify({
+        return negotiated_response({
             'folder_path': folder_path,
             'files': files_info,
             'total_files': len(files_info)
-        })
+        }, 'files')
     
     except Exception as e:
         print(f"❌ Scan error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/scan/changes', methods=['GET'])
+def scan_changes():
+    """Return changes to a folder since a cursor, or a full listing if the cursor is unusable"""
+    try:
+        folder_path = request.args.get('folder_path', '')
+        since = request.args.get('since', '')
+        force_reconcile = request.args.get('reconcile', 'false').lower() == 'true'
+        
+        if not folder_path:
+            return jsonify({'error': 'folder_path is required'}), 400
+        
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+            if not os.path.abspath(target_folder).startswith(os.path.abspath(SYNC_BASE_FOLDER)):
+                return jsonify({'error': 'Invalid folder path'}), 400
+        
+        if hash_index_db is None:
+            return jsonify({'error': 'Change journal unavailable, use /api/scan'}), 503
+        
+        os.makedirs(target_folder, exist_ok=True)
+        folder = os.path.abspath(target_folder)
+        
+        with hash_index_lock:
+            row = hash_index_db.execute(
+                'SELECT base_seq, reconciled_at FROM journal_folders WHERE folder = ?', (folder,)).fetchone()
+        if force_reconcile or row is None or time.time() - row[1] > RECONCILE_INTERVAL:
+            reconcile_folder(folder)
+        
+        with hash_index_lock:
+            base_seq = hash_index_db.execute(
+                'SELECT base_seq FROM journal_folders WHERE folder = ?', (folder,)).fetchone()[0]
+            cursor = hash_index_db.execute(
+                'SELECT COALESCE(MAX(seq), ?) FROM change_journal WHERE folder = ?', (base_seq, folder)).fetchone()[0]
+            
+            since_seq = int(since) if since.isdigit() else None
+            if since_seq is None or since_seq < base_seq or since_seq > cursor:
+                files = [
+                    {'path': path, 'size': size, 'modified': modified}
+                    for path, size, modified in hash_index_db.execute(
+                        'SELECT path, size, modified FROM folder_snapshots WHERE folder = ?', (folder,))
+                ]
+                print(f"🧾 Changes request for '{folder_path}' - full listing of {len(files)} files")
+                return jsonify({
+                    'folder_path': folder_path,
+                    'full': True,
+                    'files': files,
+                    'total_files': len(files),
+                    'cursor': str(cursor)
+                })
+            
+            changes = []
+            for seq, op, path, old_path, size, modified in hash_index_db.execute(
+                    'SELECT seq, op, path, old_path, size, modified FROM change_journal '
+                    'WHERE folder = ? AND seq > ? ORDER BY seq', (folder, since_seq)):
+                change = {'op': op, 'path': path}
+                if old_path is not None:
+                    change['old_path'] = old_path
+                if op != 'deleted':
+                    change['size'] = size
+                    change['modified'] = modified
+                changes.append(change)
+        
+        print(f"🧾 Changes request for '{folder_path}' since {since_seq} - {len(changes)} changes")
+        return jsonify({
+            'folder_path': folder_path,
+            'full': False,
+            'changes': changes,
+            'total_changes': len(changes),
+            'cursor': str(cursor)
+        })
+    
+    except Exception as e:
+        print(f"❌ Changes error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tree-digests', methods=['POST'])
+def tree_digests():
+    """Return Merkle digests for a directory and its subdirectories down to a depth"""
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        sub_path = data.get('path', '').strip('/')
+        depth = int(data.get('depth', 1))
+        mode = data.get('mode', 'stat')
+        
+        if not folder_path:
+            return jsonify({'error': 'folder_path is required'}), 400
+        if mode not in ('stat', 'content'):
+            return jsonify({'error': "mode must be 'stat' or 'content'"}), 400
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path) if not os.path.isabs(folder_path) else folder_path
+        if not os.path.isabs(folder_path):
+            if not os.path.abspath(target_folder).startswith(os.path.abspath(SYNC_BASE_FOLDER)):
+                return jsonify({'error': 'Invalid folder path'}), 400
+        
+        if '..' in sub_path.split('/'):
+            return jsonify({'error': 'Invalid path'}), 400
+        
+        digests = compute_tree_digests(target_folder, mode, algorithm, sub_path, depth)
+        directories = sorted(({'path': directory, **info} for directory, info in digests.items()),
+                             key=lambda d: d['path'])
+        
+        print(f"🌳 Tree digests for '{folder_path}/{sub_path}' - {len(directories)} directories")
+        return jsonify({
+            'folder_path': folder_path,
+            'path': sub_path,
+            'mode': mode,
+            'hash_algorithm': algorithm,
+            'directories': directories
+        })
+    except Exception as e:
+        print(f"❌ Tree digest error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/hash-files', methods=['POST'])
 def hash_files():
-    """Calculate hashes for specific files"""
+    """Calculate hashes for specific files
+    
+    file_paths entries are plain paths, or {'path', 'hash', 'modified'} objects
+    carrying the client's quick hash so collisions can be escalated.
+    """
     try:
         data = request.get_json()
         folder_path = data.get('folder_path', '')
         file_paths = data.get('file_paths', [])
+        quick = data.get('hash_mode', 'full') == 'quick'
+        escalate = quick and data.get('escalate', False)
         
         if not folder_path or not file_paths:
             return jsonify({'error': 'folder_path and file_paths required'}), 400
         
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path) if not os.path.isabs(folder_path) else folder_path
         
-        hashed_files = []
-        for file_path in file_paths:
+        full_paths = {}
+        known = {}
+        for entry in file_paths:
+            file_path = entry['path'] if isinstance(entry, dict) else entry
             full_path = os.path.join(target_folder, file_path)
-            if os.path.exists(full_path) and os.path.isfile(full_path):
-                file_hash = get_file_hash(full_path)
-                if file_hash:
-                    hashed_files.append({'path': file_path, 'hash': file_hash})
+            if os.path.isfile(full_path):
+                full_paths[full_path] = file_path
+                if isinstance(entry, dict):
+                    known[full_path] = entry
+        
+        def needs_full_hash(full_path, quick_hash):
+            """Same quick hash but a different mtime - only a full hash can tell"""
+            client = known.get(full_path)
+            if not client or client.get('hash') != quick_hash or client.get('modified') is None:
+                return False
+            try:
+                return abs(os.path.getmtime(full_path) - client['modified']) > MTIME_TOLERANCE
+            except OSError:
+                return False
+        
+        hash_mode = 'quick' if quick else 'full'
+        
+        # Streaming mode sends one JSON line per file as soon as it is hashed
+        if data.get('stream', False):
+            def generate():
+                total_hashed = 0
+                escalations = []
+                for full_path, file_hash in hash_files_parallel(full_paths, algorithm, quick):
+                    if file_hash:
+                        total_hashed += 1
+                        yield json.dumps({'path': full_paths[full_path], 'hash': file_hash}) + '\n'
+                        if escalate and needs_full_hash(full_path, file_hash):
+                            escalations.append(full_path)
+                for full_path, full_hash in hash_files_parallel(escalations, algorithm):
+                    if full_hash:
+                        yield json.dumps({'path': full_paths[full_path], 'full_hash': full_hash}) + '\n'
+                yield json.dumps({
+                    'done': True, 'total_hashed': total_hashed,
+                    'hash_algorithm': algorithm, 'hash_mode': hash_mode
+                }) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        hashes = dict(hash_files_parallel(full_paths, algorithm, quick))
+        escalations = [p for p in full_paths if escalate and hashes.get(p) and needs_full_hash(p, hashes[p])]
+        full_hashes = dict(hash_files_parallel(escalations, algorithm))
         
-        return jsonify({'hashed_files': hashed_files, 'total_hashed': len(hashed_files)})
+        hashed_files = []
+        for full_path, file_path in full_paths.items():
+            if hashes.get(full_path):
+                hashed_file = {'path': file_path, 'hash': hashes[full_path]}
+                if full_hashes.get(full_path):
+                    hashed_file['full_hash'] = full_hashes[full_path]
+                hashed_files.append(hashed_file)
+        
+        return negotiated_response({
+            'hashed_files': hashed_files,
+            'total_hashed': len(hashed_files),
+            'hash_algorithm': algorithm,
+            'hash_mode': hash_mode
+        }, 'hashed_files')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -223,136 +1522,1230 @@ def rename_file():
         if not os.path.exists(old_full):
             return jsonify({'error': 'Old file not found'}), 404
         
-        new_dir = os.path.dirname(new_full)
-        if new_dir and not os.path.exists(new_dir):
-            os.makedirs(new_dir, exist_ok=True)
+        new_dir = os.path.dirname(new_full)
+        if new_dir and not os.path.exists(new_dir):
+            os.makedirs(new_dir, exist_ok=True)
+        
+        os.rename(old_full, new_full)
+        invalidate_file_hash(os.path.abspath(old_full))
+        invalidate_file_hash(os.path.abspath(new_full))
+        record_change(target_folder, 'renamed', new_full, old_full)
+        print(f"✅ Renamed: '{old_path}' → '{new_path}'")
+        
+        return jsonify({'success': True, 'message': f'Renamed {old_path} to {new_path}'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def resolve_upload_path(target_folder, safe_filename, sync_mode, handle_duplicates):
+    """Decide where an upload lands according to sync_mode and handle_duplicates
+    
+    Returns (file_path, safe_filename). In duplicate mode the existing file is
+    moved into a new dupN folder as a side effect.
+    """
+    # Handle file path with directories
+    file_path = os.path.join(target_folder, safe_filename)
+    file_dir = os.path.dirname(file_path)
+    if file_dir and file_dir != target_folder:
+        os.makedirs(file_dir, exist_ok=True)
+    
+    # Handle existing files based on sync mode
+    if os.path.exists(file_path):
+        if sync_mode == 'MIRROR' or sync_mode == 'UPDATE':
+            # For Mirror/Update mode, overwrite existing files
+            print(f"🔄 Overwriting existing file: {safe_filename} (Mirror/Update mode)")
+        elif handle_duplicates:
+            # Find the next available dup folder number
+            dup_counter = 1
+            while os.path.exists(os.path.join(target_folder, f"dup{dup_counter}")):
+                dup_counter += 1
+            
+            # Create the duplicate folder
+            dup_folder = os.path.join(target_folder, f"dup{dup_counter}")
+            os.makedirs(dup_folder, exist_ok=True)
+            
+            # Prepare file names
+            existing_file_name = os.path.basename(file_path)
+            base_name, extension = os.path.splitext(existing_file_name)
+            
+            # Move existing file to duplicate folder with "_existing" suffix
+            existing_new_name = f"{base_name}_existing{extension}"
+            existing_new_path = os.path.join(dup_folder, existing_new_name)
+            
+            try:
+                import shutil
+                shutil.move(file_path, existing_new_path)
+                invalidate_file_hash(os.path.abspath(file_path))
+                record_change(target_folder, 'renamed', existing_new_path, file_path)
+                print(f"📁 Moved existing file to: dup{dup_counter}/{existing_new_name}")
+            except Exception as e:
+                print(f"⚠️ Could not move existing file: {e}")
+            
+            # Set path for new file with "_new" suffix in the same duplicate folder
+            new_file_name = f"{base_name}_new{extension}"
+            file_path = os.path.join(dup_folder, new_file_name)
+            print(f"📁 Will save new file as: dup{dup_counter}/{new_file_name}")
+            
+        else:
+            # Add counter to filename
+            counter = 1
+            base_name, extension = os.path.splitext(safe_filename)
+            original_file_path = file_path
+            
+            while os.path.exists(file_path):
+                safe_filename = f"{base_name} ({counter}){extension}"
+                file_path = os.path.join(target_folder, safe_filename)
+                counter += 1
+    
+    return file_path, safe_filename
+
+def place_upload(part_path, target_folder, safe_filename, sync_mode, handle_duplicates,
+                 file_hash, algorithm, expected_hash=None, deduplicate=True):
+    """Verify a fully received upload and move it into place
+    
+    The digest computed while receiving seeds the hash cache, so the file never
+    has to be re-read for /api/hash-files. With FOLDERSYNC_DEDUP on, an
+    identical file already at the destination (by its cached hash) is kept
+    instead of being overwritten or duplicated, and otherwise the upload
+    shares storage with any identical file.
+    Returns (file_path, safe_filename, deduplicated), or (None, None, False)
+    when expected_hash does not match and the upload was dropped.
+    """
+    if expected_hash and expected_hash.lower() != file_hash:
+        os.remove(part_path)
+        return None, None, False
+    
+    deduplicated = False
+    if deduplicate and DEDUP_MODE != 'off':
+        # Same bytes already there (going by the cached hash only, an old file is
+        # never re-read here) - just touch it so mtime comparisons see a fresh copy
+        file_path = os.path.join(target_folder, safe_filename)
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            if (stat.st_size == os.path.getsize(part_path)
+                    and get_cached_hash(os.path.abspath(file_path), stat, algorithm) == file_hash):
+                os.remove(part_path)
+                # A hardlinked file shares its mtime with every other link, so leave those alone
+                if stat.st_nlink == 1:
+                    os.utime(file_path)
+                store_file_hash(os.path.abspath(file_path), os.stat(file_path), file_hash, algorithm)
+                print(f"♻️ Identical file already present: {safe_filename}")
+                return file_path, safe_filename, True
+        
+        source = find_file_by_hash(file_hash, algorithm, os.path.getsize(part_path))
+        # Keeps the partial suffix so scans and the live index skip it too
+        shared_path = f"{part_path[:-len(PARTIAL_UPLOAD_SUFFIX)]}.shared{PARTIAL_UPLOAD_SUFFIX}"
+        if source and share_file(source, shared_path):
+            os.replace(shared_path, part_path)
+            # Only a reflinked copy has its own inode to re-timestamp, a hardlink
+            # would move the original's mtime and make it look modified
+            if os.stat(part_path).st_nlink == 1:
+                os.utime(part_path)
+            deduplicated = True
+            print(f"🔗 Sharing storage with identical file: {os.path.relpath(source, SYNC_BASE_FOLDER)}")
+    
+    file_path, safe_filename = resolve_upload_path(target_folder, safe_filename, sync_mode, handle_duplicates)
+    invalidate_file_hash(os.path.abspath(file_path))
+    existed = os.path.exists(file_path)
+    try:
+        os.replace(part_path, file_path)
+    except OSError:
+        # Target on another drive - fall back to a copy
+        shutil.move(part_path, file_path)
+    
+    store_file_hash(os.path.abspath(file_path), os.stat(file_path), file_hash, algorithm)
+    record_change(target_folder, 'modified' if existed else 'added', file_path)
+    return file_path, safe_filename, deduplicated
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    """Upload a file to PC (optional 'checksum' form field is verified)"""
+    part_path = None
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided'}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        # Get folder path, original filename, and duplicate handling preference
+        folder_path = request.form.get('folder_path', '')
+        original_filename = request.form.get('original_filename', file.filename)
+        handle_duplicates = request.form.get('handle_duplicates', 'true').lower() == 'true'
+        
+        if not folder_path:
+            return jsonify({'error': 'folder_path is required'}), 400
+        
+        # Create safe filename and path
+        safe_filename = create_safe_filename(original_filename)
+        
+        # Handle both absolute and relative paths
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+        
+        # Ensure target folder exists
+        os.makedirs(target_folder, exist_ok=True)
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, request.form.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Get sync mode to determine file handling behavior
+        sync_mode = request.form.get('sync_mode', 'COPY_AND_DELETE')
+        
+        # Save file next to its destination, hashing while writing
+        start_time = time.time()
+        file_dir = os.path.dirname(os.path.join(target_folder, safe_filename))
+        os.makedirs(file_dir, exist_ok=True)
+        part_path = os.path.join(file_dir, f".{uuid.uuid4().hex}{PARTIAL_UPLOAD_SUFFIX}")
+        hasher = HASH_ALGORITHMS[algorithm]()
+        file_size = stream_to_file(file.stream, part_path, hasher)
+        file_hash = hasher.hexdigest()
+        
+        file_path, safe_filename, deduplicated = place_upload(part_path, target_folder, safe_filename, sync_mode,
+                                                              handle_duplicates, file_hash, algorithm,
+                                                              request.form.get('checksum'))
+        part_path = None
+        if file_path is None:
+            print(f"❌ Checksum mismatch for upload: {original_filename}")
+            return jsonify({'error': 'Checksum mismatch', 'hash': file_hash}), 422
+        end_time = time.time()
+        
+        # Get file info
+        upload_time = end_time - start_time
+        speed = file_size / upload_time if upload_time > 0 else 0
+        
+        # Determine the final filename for logging
+        final_filename = os.path.basename(file_path)
+        if handle_duplicates and "dup" in file_path:
+            dup_folder_name = os.path.basename(os.path.dirname(file_path))
+            print(f"✅ Uploaded to duplicate folder: {dup_folder_name}/{final_filename} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
+        else:
+            print(f"✅ Uploaded: {final_filename} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
+        
+        return jsonify({
+            'success': True,
+            'filename': safe_filename,
+            'size': file_size,
+            'upload_time': upload_time,
+            'hash': file_hash,
+            'hash_algorithm': algorithm,
+            'deduplicated': deduplicated
+        })
+    
+    except Exception as e:
+        print(f"❌ Upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+def stream_to_file(stream, file_path, hasher=None, progress=None):
+    """Copy a request body stream to a file in large buffers, hashing as it goes"""
+    length = 0
+    with open(file_path, 'wb') as f:
+        while True:
+            chunk = stream.read(UPLOAD_BUFFER_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            length += len(chunk)
+            if progress is not None:
+                progress(length)
+    return length
+
+@app.route('/api/upload/stream', methods=['POST', 'PUT'])
+def upload_file_stream():
+    """Upload a file sent as the raw request body
+    
+    Skips multipart parsing, so bytes go straight from the socket into a
+    partial file next to the destination that is renamed into place - one
+    disk write instead of werkzeug's spool file plus a copy. Parameters come
+    from the query string: folder_path, original_filename, sync_mode,
+    handle_duplicates (same meaning as /api/upload) and an optional checksum
+    (or X-Content-Hash header) that the received bytes must match.
+    """
+    part_path = None
+    progress_id = None
+    try:
+        progress_id = request_progress_id()
+        folder_path = request.args.get('folder_path', '')
+        original_filename = request.args.get('original_filename', '') or request.headers.get('X-Filename', '')
+        handle_duplicates = request.args.get('handle_duplicates', 'true').lower() == 'true'
+        sync_mode = request.args.get('sync_mode', 'COPY_AND_DELETE')
+        
+        if not folder_path or not original_filename:
+            return jsonify({'error': 'folder_path and original_filename are required'}), 400
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, request.args.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        safe_filename = create_safe_filename(original_filename)
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+        
+        file_dir = os.path.dirname(os.path.join(target_folder, safe_filename))
+        os.makedirs(file_dir, exist_ok=True)
+        
+        # Receive first, so a dropped connection never disturbs the existing file
+        start_time = time.time()
+        part_path = os.path.join(file_dir, f".{uuid.uuid4().hex}{PARTIAL_UPLOAD_SUFFIX}")
+        hasher = HASH_ALGORITHMS[algorithm]()
+        file_size = stream_to_file(request.stream, part_path, hasher,
+                                   transfer_progress(progress_id, request.content_length))
+        
+        if request.content_length is not None and file_size != request.content_length:
+            return jsonify({'error': f'Incomplete upload: got {file_size} of {request.content_length} bytes'}), 400
+        
+        file_hash = hasher.hexdigest()
+        expected_hash = request.args.get('checksum') or request.headers.get('X-Content-Hash')
+        file_path, safe_filename, deduplicated = place_upload(part_path, target_folder, safe_filename, sync_mode,
+                                                              handle_duplicates, file_hash, algorithm, expected_hash)
+        part_path = None
+        if file_path is None:
+            print(f"❌ Checksum mismatch for stream upload: {original_filename}")
+            return jsonify({'error': 'Checksum mismatch', 'hash': file_hash}), 422
+        
+        upload_time = time.time() - start_time
+        speed = file_size / upload_time if upload_time > 0 else 0
+        print(f"✅ Uploaded (stream): {os.path.basename(file_path)} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
+        
+        result = {
+            'success': True,
+            'filename': safe_filename,
+            'size': file_size,
+            'upload_time': upload_time,
+            'hash': file_hash,
+            'hash_algorithm': algorithm,
+            'deduplicated': deduplicated
+        }
+        if progress_id:
+            publish_progress(f"progress/{progress_id}", 'done', result)
+        return jsonify(result)
+    
+    except Exception as e:
+        print(f"❌ Stream upload error: {e}")
+        if progress_id:
+            publish_progress(f"progress/{progress_id}", 'error', {'error': str(e)})
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+def copy_existing_content(source, target_folder, safe_filename, sync_mode, handle_duplicates,
+                          file_hash, algorithm):
+    """Place a copy of a file the server already has, as if it had been uploaded"""
+    file_dir = os.path.dirname(os.path.join(target_folder, safe_filename))
+    os.makedirs(file_dir, exist_ok=True)
+    
+    part_path = os.path.join(file_dir, f".{uuid.uuid4().hex}{PARTIAL_UPLOAD_SUFFIX}")
+    try:
+        if not share_file(source, part_path):
+            shutil.copyfile(source, part_path)
+        file_path, safe_filename, _ = place_upload(part_path, target_folder, safe_filename, sync_mode,
+                                                   handle_duplicates, file_hash, algorithm, deduplicate=False)
+        return file_path, safe_filename
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+@app.route('/api/upload/by-hash', methods=['POST'])
+def upload_by_hash():
+    """Create a file from content the server already has, without transferring it
+    
+    Takes the same fields as /api/upload plus 'hash' (and optionally 'size'
+    and 'hash_algorithm'). Responds 404 with needed=true when no identical
+    file exists, in which case the client uploads normally.
+    """
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        original_filename = data.get('original_filename', '')
+        file_hash = str(data.get('hash', '')).lower()
+        
+        if not folder_path or not original_filename or not file_hash:
+            return jsonify({'error': 'folder_path, original_filename and hash are required'}), 400
+        if DEDUP_MODE == 'off':
+            return jsonify({'error': 'Deduplication is disabled', 'needed': True}), 404
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        source = find_file_by_hash(file_hash, algorithm, data.get('size'))
+        if source is None:
+            return jsonify({'error': 'No file with that hash', 'needed': True}), 404
+        
+        safe_filename = create_safe_filename(original_filename)
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+        
+        file_path, safe_filename = copy_existing_content(
+            source, target_folder, safe_filename,
+            data.get('sync_mode', 'COPY_AND_DELETE'),
+            str(data.get('handle_duplicates', 'true')).lower() == 'true',
+            file_hash, algorithm)
+        
+        print(f"♻️ Uploaded (by hash): {os.path.basename(file_path)} from {os.path.relpath(source, SYNC_BASE_FOLDER)}")
+        return jsonify({
+            'success': True,
+            'filename': safe_filename,
+            'size': os.path.getsize(file_path),
+            'hash': file_hash,
+            'hash_algorithm': algorithm,
+            'deduplicated': True
+        })
+    
+    except Exception as e:
+        print(f"❌ Upload by hash error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/have', methods=['POST'])
+def upload_have():
+    """Tell the client which files it actually needs to send
+    
+    Takes folder_path and files: [{'path', 'size', 'hash'}] and answers each
+    with a status: 'present' (identical file already at that path), 'copied'
+    (identical content elsewhere was copied into place), 'moved' (with
+    allow_moves, a file in this folder that the client no longer lists was
+    renamed into place) or 'needed'. Content is found through the hash index,
+    so only files the server has hashed before can be matched.
+    """
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        files = data.get('files', [])
+        allow_moves = str(data.get('allow_moves', 'false')).lower() == 'true'
+        sync_mode = data.get('sync_mode', 'COPY_AND_DELETE')
+        handle_duplicates = str(data.get('handle_duplicates', 'true')).lower() == 'true'
+        
+        if not folder_path:
+            return jsonify({'error': 'folder_path is required'}), 400
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+        os.makedirs(target_folder, exist_ok=True)
+        
+        # Files the client still has may be copied from but never moved away
+        folder_prefix = os.path.abspath(target_folder) + os.sep
+        listed = {os.path.abspath(os.path.join(target_folder, create_safe_filename(f.get('path', ''))))
+                  for f in files}
+        
+        results = []
+        summary = {'present': 0, 'copied': 0, 'moved': 0, 'needed': 0, 'error': 0}
+        for entry in files:
+            relative_path = entry.get('path', '')
+            file_hash = str(entry.get('hash', '')).lower()
+            size = entry.get('size')
+            result = {'path': relative_path}
+            try:
+                if not relative_path or not file_hash:
+                    raise ValueError('path and hash are required')
+                safe_filename = create_safe_filename(relative_path)
+                file_path = os.path.join(target_folder, safe_filename)
+                
+                if (os.path.isfile(file_path) and (size is None or os.path.getsize(file_path) == size)
+                        and get_file_hash(file_path, algorithm=algorithm) == file_hash):
+                    result['status'] = 'present'
+                else:
+                    sources = find_files_by_hash(file_hash, algorithm, size)
+                    movable = [path for path in sources if path.startswith(folder_prefix) and path not in listed]
+                    if allow_moves and movable:
+                        source = movable[0]
+                        file_path, safe_filename = resolve_upload_path(
+                            target_folder, safe_filename, sync_mode, handle_duplicates)
+                        invalidate_file_hash(source)
+                        invalidate_file_hash(os.path.abspath(file_path))
+                        os.replace(source, file_path)
+                        store_file_hash(os.path.abspath(file_path), os.stat(file_path), file_hash, algorithm)
+                        record_change(target_folder, 'renamed', file_path, source)
+                        result['status'] = 'moved'
+                    elif sources:
+                        source = sources[0]
+                        file_path, safe_filename = copy_existing_content(
+                            source, target_folder, safe_filename, sync_mode, handle_duplicates,
+                            file_hash, algorithm)
+                        result['status'] = 'copied'
+                    else:
+                        result['status'] = 'needed'
+                    
+                    if result['status'] != 'needed':
+                        result['source'] = os.path.relpath(source, SYNC_BASE_FOLDER).replace('\\', '/')
+                        result['filename'] = safe_filename
+            except Exception as e:
+                result['status'] = 'error'
+                result['error'] = str(e)
+            
+            summary[result['status']] += 1
+            results.append(result)
+        
+        print(f"🤝 Have check for {folder_path}: {summary['present']} present, {summary['copied']} copied, "
+              f"{summary['moved']} moved, {summary['needed']} needed")
+        return jsonify({'folder_path': folder_path, 'results': results, 'summary': summary})
+    
+    except Exception as e:
+        print(f"❌ Have check error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Resumable uploads - a session owns a preallocated partial file under the
+# state folder; chunks are PUT at explicit offsets (in parallel if the client
+# likes, written with positional writes) and the file is moved into place on commit
+UPLOAD_SESSION_FOLDER = os.path.join(STATE_FOLDER, 'uploads')
+UPLOAD_SESSION_TTL = 24 * 3600  # Abandoned sessions are removed after a day
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Suggested chunk size for clients
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+os.makedirs(UPLOAD_SESSION_FOLDER, exist_ok=True)
+
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+
+def upload_session_paths(upload_id):
+    """Return (metadata path, partial data path) for a session"""
+    return (os.path.join(UPLOAD_SESSION_FOLDER, f"{upload_id}.json"),
+            os.path.join(UPLOAD_SESSION_FOLDER, f"{upload_id}.part"))
+
+def save_upload_session(session):
+    """Persist session metadata so uploads survive a server restart"""
+    meta_path, _ = upload_session_paths(session['upload_id'])
+    temp_path = meta_path + f'.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({k: v for k, v in session.items() if not k.startswith('_')}, f)
+    os.replace(temp_path, meta_path)
+
+def get_upload_session(upload_id):
+    """Look up a session in memory, falling back to its metadata on disk"""
+    if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+        return None
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+        if session is None:
+            meta_path, _ = upload_session_paths(upload_id)
+            if not os.path.exists(meta_path):
+                return None
+            with open(meta_path) as f:
+                session = json.load(f)
+            session['_lock'] = threading.Lock()
+            session['_write_lock'] = threading.Lock()
+            session['_hasher'] = None  # Running digest is lost on restart, commit re-reads instead
+            upload_sessions[upload_id] = session
+        return session
+
+def discard_upload_session(upload_id):
+    """Forget a session and delete its files"""
+    with upload_sessions_lock:
+        upload_sessions.pop(upload_id, None)
+    for path in upload_session_paths(upload_id):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def expire_upload_sessions():
+    """Remove sessions that have not been touched within UPLOAD_SESSION_TTL"""
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    for name in os.listdir(UPLOAD_SESSION_FOLDER):
+        if name.endswith('.json') and os.path.getmtime(os.path.join(UPLOAD_SESSION_FOLDER, name)) < cutoff:
+            upload_id = name[:-len('.json')]
+            discard_upload_session(upload_id)
+            print(f"🧹 Expired upload session {upload_id}")
+
+def preallocate_file(path, size):
+    """Create a file of the final size up front so chunks can land anywhere"""
+    with open(path, 'wb') as f:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+def write_chunk_at(fd, session, data, position):
+    """Positional write - os.pwrite where available, else seek+write under the session lock"""
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, position)
+            data = data[written:]
+            position += written
+    else:
+        with session['_write_lock']:
+            os.lseek(fd, position, os.SEEK_SET)
+            os.write(fd, data)
+
+def add_received_range(ranges, start, end):
+    """Merge [start, end) into a sorted list of disjoint [start, end] ranges"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+def session_info(session):
+    """Public view of a session"""
+    received = sum(end - start for start, end in session['ranges'])
+    return {
+        'upload_id': session['upload_id'],
+        'filename': session['original_filename'],
+        'size': session['size'],
+        'received': session['ranges'],
+        'chunks': len(session['chunks']),
+        'received_bytes': received,
+        'complete': session['ranges'] == [[0, session['size']]] or session['size'] == 0,
+        'chunk_size': UPLOAD_CHUNK_SIZE
+    }
+
+def claim_inline_hash(session, offset):
+    """Let a chunk feed the whole-file digest while streaming if it continues it"""
+    with session['_lock']:
+        inline = (session['_hasher'] is not None and not session['_hashing']
+                  and session['_hashed_to'] == offset)
+        if inline:
+            session['_hashing'] = True
+    return inline
+
+def release_inline_hash(session, inline, length, chunk_ok):
+    """Advance the whole-file digest past a finished chunk, or drop it if the chunk was bad"""
+    if not inline:
+        return
+    with session['_lock']:
+        session['_hashing'] = False
+        if chunk_ok:
+            session['_hashed_to'] += length
+        else:
+            session['_hasher'] = None
+
+def record_session_chunk(session, offset, length, chunk_hash):
+    """Record a verified chunk, persist the session and publish progress"""
+    with session['_lock']:
+        if length:
+            session['ranges'] = add_received_range(session['ranges'], offset, offset + length)
+            session['chunks'][str(offset)] = {'length': length, 'hash': chunk_hash}
+        save_upload_session(session)
+        info = session_info(session)
+    
+    publish_progress(f"upload/{session['upload_id']}", 'progress', {
+        'received_bytes': info['received_bytes'], 'size': info['size'], 'complete': info['complete']
+    })
+    info['chunk_hash'] = chunk_hash
+    return info
+
+@app.route('/api/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """Start a resumable upload"""
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        original_filename = data.get('original_filename', '')
+        size = data.get('size')
+        
+        if not folder_path or not original_filename or size is None:
+            return jsonify({'error': 'folder_path, original_filename and size are required'}), 400
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        expire_upload_sessions()
+        
+        upload_id = uuid.uuid4().hex
+        session = {
+            'upload_id': upload_id,
+            'folder_path': folder_path,
+            'original_filename': original_filename,
+            'size': int(size),
+            'sync_mode': data.get('sync_mode', 'COPY_AND_DELETE'),
+            'handle_duplicates': str(data.get('handle_duplicates', 'true')).lower() == 'true',
+            'hash_algorithm': algorithm,
+            'checksum': data.get('checksum'),
+            'ranges': [],
+            'chunks': {},
+            'created': time.time()
+        }
+        _, part_path = upload_session_paths(upload_id)
+        preallocate_file(part_path, session['size'])
+        save_upload_session(session)
+        
+        session['_lock'] = threading.Lock()
+        session['_write_lock'] = threading.Lock()
+        # Whole-file digest, fed inline while chunks arrive in order
+        session['_hasher'] = HASH_ALGORITHMS[algorithm]()
+        session['_hashed_to'] = 0
+        session['_hashing'] = False
+        with upload_sessions_lock:
+            upload_sessions[upload_id] = session
+        
+        print(f"📤 Upload session {upload_id} started: {original_filename} ({session['size']} bytes)")
+        return jsonify(session_info(session))
+    except Exception as e:
+        print(f"❌ Upload session error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['GET'])
+def get_upload_session_status(upload_id):
+    """Report which byte ranges of a resumable upload have been received"""
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload session not found'}), 404
+    return jsonify(session_info(session))
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['PUT'])
+def upload_session_chunk(upload_id):
+    """Write one chunk at ?offset=N, verified against an optional X-Chunk-Hash (MD5)
+    
+    Chunks of the same session may be sent concurrently on separate connections.
+    """
+    try:
+        session = get_upload_session(upload_id)
+        if session is None:
+            return jsonify({'error': 'Upload session not found'}), 404
+        
+        offset = request.args.get('offset', type=int)
+        if offset is None or offset < 0 or offset > session['size']:
+            return jsonify({'error': 'Valid offset is required'}), 400
+        expected_hash = request.headers.get('X-Chunk-Hash', '').lower()
+        
+        inline = claim_inline_hash(session, offset)
+        _, part_path = upload_session_paths(upload_id)
+        hasher = hashlib.md5()
+        length = 0
+        chunk_ok = False
+        fd = os.open(part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            while True:
+                chunk = request.stream.read(UPLOAD_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if offset + length + len(chunk) > session['size']:
+                    return jsonify({'error': 'Chunk extends past the declared file size'}), 400
+                write_chunk_at(fd, session, chunk, offset + length)
+                hasher.update(chunk)
+                if inline:
+                    session['_hasher'].update(chunk)
+                length += len(chunk)
+            
+            chunk_hash = hasher.hexdigest()
+            chunk_ok = not expected_hash or expected_hash == chunk_hash
+        finally:
+            os.close(fd)
+            release_inline_hash(session, inline, length, chunk_ok)
+        
+        if not chunk_ok:
+            print(f"⚠️ Chunk checksum mismatch for {upload_id} at offset {offset}")
+            return jsonify({'error': 'Chunk checksum mismatch', 'hash': chunk_hash}), 422
+        
+        info = record_session_chunk(session, offset, length, chunk_hash)
+        return jsonify(info)
+    except Exception as e:
+        print(f"❌ Upload chunk error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<upload_id>/commit', methods=['POST'])
+def commit_upload_session(upload_id):
+    """Move a fully received upload into place, honouring sync_mode and handle_duplicates
+    
+    An optional JSON body {'chunks': [{'offset', 'length', 'hash'}]} is checked
+    against the digests recorded as each chunk arrived, and an optional
+    'checksum' (or the one given at session creation) against the whole file.
+    """
+    try:
+        session = get_upload_session(upload_id)
+        if session is None:
+            return jsonify({'error': 'Upload session not found'}), 404
+        data = request.get_json(silent=True) or {}
+        
+        with session['_lock']:
+            info = session_info(session)
+            if not info['complete']:
+                return jsonify({'error': 'Upload is incomplete', **info}), 409
+            
+            mismatched = []
+            for chunk in data.get('chunks', []):
+                recorded = session['chunks'].get(str(chunk.get('offset')))
+                if (not recorded or recorded['length'] != chunk.get('length')
+                        or recorded['hash'] != str(chunk.get('hash', '')).lower()):
+                    mismatched.append(chunk.get('offset'))
+            if mismatched:
+                print(f"⚠️ Commit of {upload_id} rejected: {len(mismatched)} chunk digests differ")
+                return jsonify({'error': 'Chunk digests do not match', 'offsets': mismatched}), 422
+            
+            folder_path = session['folder_path']
+            if os.path.isabs(folder_path):
+                target_folder = folder_path
+            else:
+                target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+            os.makedirs(target_folder, exist_ok=True)
+            
+            # Chunks that arrived in order were hashed on the way in, otherwise read the file once
+            algorithm = session['hash_algorithm']
+            _, part_path = upload_session_paths(upload_id)
+            if session['_hasher'] is not None and session['_hashed_to'] == session['size']:
+                file_hash = session['_hasher'].hexdigest()
+            else:
+                file_hash = compute_file_hash(part_path, algorithm)
+            
+            safe_filename = create_safe_filename(session['original_filename'])
+            file_path, safe_filename, deduplicated = place_upload(
+                part_path, target_folder, safe_filename, session['sync_mode'], session['handle_duplicates'],
+                file_hash, algorithm, data.get('checksum') or session.get('checksum'))
+        
+        discard_upload_session(upload_id)
+        if file_path is None:
+            print(f"❌ Checksum mismatch for resumable upload {upload_id}")
+            return jsonify({'error': 'Checksum mismatch', 'hash': file_hash}), 422
+        
+        file_size = os.path.getsize(file_path)
+        print(f"✅ Uploaded (resumable): {os.path.basename(file_path)} ({file_size} bytes)")
+        
+        result = {
+            'success': True,
+            'filename': safe_filename,
+            'size': file_size,
+            'hash': file_hash,
+            'hash_algorithm': algorithm,
+            'deduplicated': deduplicated
+        }
+        publish_progress(f"upload/{upload_id}", 'committed', result)
+        return jsonify(result)
+    except Exception as e:
+        print(f"❌ Upload commit error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['DELETE'])
+def abort_upload_session(upload_id):
+    """Abandon a resumable upload"""
+    if get_upload_session(upload_id) is None:
+        return jsonify({'error': 'Upload session not found'}), 404
+    discard_upload_session(upload_id)
+    publish_progress(f"upload/{upload_id}", 'cancelled', {'upload_id': upload_id})
+    return jsonify({'success': True})
+
+@app.route('/api/upload/sessions/<upload_id>/events')
+def upload_session_events(upload_id):
+    """SSE stream of bytes received for a resumable upload, ending with 'committed' or 'cancelled'"""
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload session not found'}), 404
+    with session['_lock']:
+        info = session_info(session)
+    channel = get_progress_channel(f"upload/{upload_id}")
+    if channel['version'] == 0:
+        publish_progress(f"upload/{upload_id}", 'progress', {
+            'received_bytes': info['received_bytes'], 'size': info['size'], 'complete': info['complete']
+        })
+    return progress_response(f"upload/{upload_id}", f"/api/upload/sessions/{upload_id}")
+
+# Delta transfer - rsync-style block matching. Signatures are
+# (adler32, md5) per block; the adler32 is the same value zlib and
+# java.util.zip.Adler32 produce, rolled one byte at a time between matches.
+# Rolling is pure Python (about 1 MB/s), so after DELTA_MAX_ROLL bytes without
+# a match, or DELTA_ROLL_BUDGET rolled bytes in total, the search only probes
+# block-aligned offsets - C-speed per block, still finding in-place edits and
+# appends, just not content shifted by a long insertion.
+# A delta stream is DELTA_MAGIC followed by ops:
+#   DELTA_OP_COPY    varint block index, varint block count
+#   DELTA_OP_LITERAL varint length, raw bytes
+#   DELTA_OP_END
+DELTA_MIME_TYPE = 'application/x-foldersync-delta'
+DELTA_MAGIC = b'FSD1'
+DELTA_OP_END = 0
+DELTA_OP_COPY = 1
+DELTA_OP_LITERAL = 2
+DELTA_MIN_BLOCK_SIZE = 2048
+DELTA_MAX_BLOCK_SIZE = 1024 * 1024
+DELTA_LITERAL_CHUNK = 1024 * 1024
+DELTA_FLUSH_SIZE = 256 * 1024
+DELTA_MAX_ROLL = 2 * 1024 * 1024
+DELTA_ROLL_BUDGET = 8 * 1024 * 1024
+ADLER_MOD = 65521
+
+def delta_block_size(file_size):
+    """Pick a block size around sqrt(size), like rsync, in 1 KB steps"""
+    block_size = -(-int(math.sqrt(file_size)) // 1024) * 1024
+    return max(DELTA_MIN_BLOCK_SIZE, min(DELTA_MAX_BLOCK_SIZE, block_size))
+
+def file_signature(file_path, block_size):
+    """Return [(adler32, md5 hex)] for each block of a file"""
+    blocks = []
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            blocks.append((zlib.adler32(block), hashlib.md5(block).hexdigest()))
+    return blocks
+
+def generate_delta(file_path, signature, block_size):
+    """Yield a delta stream that rebuilds file_path from a file with the given signature"""
+    table = {}
+    for index, (weak, strong) in enumerate(signature):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    
+    out = bytearray(DELTA_MAGIC)
+    copy_run = None  # [first block, count] waiting to be written
+    
+    def flush_copy():
+        nonlocal copy_run
+        if copy_run:
+            out.append(DELTA_OP_COPY)
+            write_varint(out, copy_run[0])
+            write_varint(out, copy_run[1])
+            copy_run = None
+    
+    def add_literal(data):
+        flush_copy()
+        for position in range(0, len(data), DELTA_LITERAL_CHUNK):
+            piece = data[position:position + DELTA_LITERAL_CHUNK]
+            out.append(DELTA_OP_LITERAL)
+            write_varint(out, len(piece))
+            out.extend(piece)
+    
+    def add_copy(index):
+        nonlocal copy_run
+        if copy_run and copy_run[0] + copy_run[1] == index:
+            copy_run[1] += 1
+        else:
+            flush_copy()
+            copy_run = [index, 1]
+    
+    def match(start, end, weak):
+        candidates = table.get(weak)
+        if candidates:
+            return candidates.get(hashlib.md5(data[start:end]).hexdigest())
+        return None
+    
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        try:
+            pos = literal_start = last_match = 0
+            rolled = 0
+            weak = None
+            while table and pos + block_size <= size:
+                if weak is None:
+                    weak = zlib.adler32(data[pos:pos + block_size])
+                index = match(pos, pos + block_size, weak)
+                if index is not None:
+                    if literal_start < pos:
+                        add_literal(data[literal_start:pos])
+                    add_copy(index)
+                    pos += block_size
+                    literal_start = last_match = pos
+                    weak = None
+                elif pos - last_match >= DELTA_MAX_ROLL or rolled >= DELTA_ROLL_BUDGET:
+                    # Too long without a match - probe the next offset in step with the last match
+                    pos += block_size - (pos - last_match) % block_size
+                    weak = None
+                    if pos - literal_start >= DELTA_LITERAL_CHUNK:
+                        add_literal(data[literal_start:pos])
+                        literal_start = pos
+                else:
+                    rolled += 1
+                    if pos + block_size < size:
+                        # Roll the window forward one byte
+                        out_byte = data[pos]
+                        a = ((weak & 0xffff) - out_byte + data[pos + block_size]) % ADLER_MOD
+                        b = ((weak >> 16) - block_size * out_byte + a - 1) % ADLER_MOD
+                        weak = (b << 16) | a
+                    pos += 1
+                    if pos - literal_start >= DELTA_LITERAL_CHUNK:
+                        add_literal(data[literal_start:pos])
+                        literal_start = pos
+                
+                if len(out) >= DELTA_FLUSH_SIZE:
+                    yield bytes(out)
+                    out.clear()
+            
+            # A short final block can only match the basis file's own short tail
+            tail_start = max(literal_start, pos)
+            if table and tail_start < size:
+                index = match(tail_start, size, zlib.adler32(data[tail_start:size]))
+                if index is not None and index == len(signature) - 1:
+                    if literal_start < tail_start:
+                        add_literal(data[literal_start:tail_start])
+                    add_copy(index)
+                    literal_start = size
+            if literal_start < size:
+                add_literal(data[literal_start:size])
+        finally:
+            if size:
+                data.close()
+    
+    flush_copy()
+    out.append(DELTA_OP_END)
+    yield bytes(out)
+
+def read_exact(stream, length):
+    """Read exactly length bytes from a stream"""
+    data = bytearray()
+    while len(data) < length:
+        chunk = stream.read(min(length - len(data), UPLOAD_BUFFER_SIZE))
+        if not chunk:
+            raise ValueError('Delta stream ended early')
+        data.extend(chunk)
+    return bytes(data)
+
+def read_stream_varint(stream):
+    """Read an unsigned LEB128 varint from a stream"""
+    value = shift = 0
+    while True:
+        byte = read_exact(stream, 1)[0]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value
+        shift += 7
+
+def apply_delta(stream, basis_path, out_path, block_size, hasher=None):
+    """Rebuild a file from a basis file and a delta stream, returning its size"""
+    if read_exact(stream, len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError('Not a delta stream')
+    
+    length = 0
+    basis_size = os.path.getsize(basis_path)
+    with open(basis_path, 'rb') as basis, open(out_path, 'wb') as out:
+        while True:
+            op = read_exact(stream, 1)[0]
+            if op == DELTA_OP_END:
+                return length
+            if op == DELTA_OP_COPY:
+                index = read_stream_varint(stream)
+                count = read_stream_varint(stream)
+                if index * block_size >= basis_size:
+                    raise ValueError(f'Delta copies block {index} past the end of the basis file')
+                basis.seek(index * block_size)
+                remaining = count * block_size
+                while remaining > 0:
+                    chunk = basis.read(min(remaining, UPLOAD_BUFFER_SIZE))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    length += len(chunk)
+                    remaining -= len(chunk)
+            elif op == DELTA_OP_LITERAL:
+                remaining = read_stream_varint(stream)
+                while remaining > 0:
+                    chunk = read_exact(stream, min(remaining, UPLOAD_BUFFER_SIZE))
+                    out.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    length += len(chunk)
+                    remaining -= len(chunk)
+            else:
+                raise ValueError(f'Unknown delta op {op}')
+
+def resolve_delta_file(folder_path, path):
+    """Map folder_path and a relative path to (target_folder, file_path), or raise ValueError"""
+    if os.path.isabs(folder_path):
+        target_folder = folder_path
+    else:
+        target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+    file_path = os.path.join(target_folder, create_safe_filename(path))
+    if not os.path.isabs(folder_path) and not os.path.abspath(file_path).startswith(os.path.abspath(SYNC_BASE_FOLDER)):
+        raise ValueError('Invalid file path')
+    return target_folder, file_path
+
+@app.route('/api/delta/signature', methods=['POST'])
+def delta_signature():
+    """Block signatures of a server file, for building an upload delta against it"""
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        path = data.get('path', '')
+        if not folder_path or not path:
+            return jsonify({'error': 'folder_path and path are required'}), 400
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+            target_folder, file_path = resolve_delta_file(folder_path, path)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not os.path.isfile(file_path):
+            return jsonify({'error': 'File not found'}), 404
         
-        os.rename(old_full, new_full)
-        print(f"✅ Renamed: '{old_path}' → '{new_path}'")
+        size = os.path.getsize(file_path)
+        block_size = int(data.get('block_size') or delta_block_size(size))
+        blocks = file_signature(file_path, block_size)
+        print(f"🧬 Signature for {path}: {len(blocks)} blocks of {block_size} bytes")
         
-        return jsonify({'success': True, 'message': f'Renamed {old_path} to {new_path}'})
+        return jsonify({
+            'path': path,
+            'size': size,
+            'block_size': block_size,
+            'hash': get_file_hash(file_path, algorithm=algorithm),
+            'hash_algorithm': algorithm,
+            'blocks': blocks
+        })
     except Exception as e:
+        print(f"❌ Delta signature error: {e}")
         return jsonify({'error': str(e)}), 500
 
-
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    """Upload a file to PC"""
+@app.route('/api/delta/apply', methods=['POST', 'PUT'])
+def delta_apply():
+    """Rebuild a server file from an uploaded delta stream
+    
+    Query parameters: folder_path, path, block_size (from the signature),
+    basis_hash (the signature's hash - the file must not have changed since)
+    and an optional checksum of the rebuilt file. The result replaces the file.
+    """
+    part_path = None
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-        
-        # Get folder path, original filename, and duplicate handling preference
-        folder_path = request.form.get('folder_path', '')
-        original_filename = request.form.get('original_filename', file.filename)
-        handle_duplicates = request.form.get('handle_duplicates', 'true').lower() == 'true'
-        
-        if not folder_path:
-            return jsonify({'error': 'folder_path is required'}), 400
-        
-        # Create safe filename and path
-        safe_filename = create_safe_filename(original_filename)
-        
-        # Handle both absolute and relative paths
-        if os.path.isabs(folder_path):
-            target_folder = folder_path
-        else:
-            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
-        
-        # Ensure target folder exists
-        os.makedirs(target_folder, exist_ok=True)
-        
-        # Handle file path with directories
-        file_path = os.path.join(target_folder, safe_filename)
-        file_dir = os.path.dirname(file_path)
-        if file_dir and file_dir != target_folder:
-            os.makedirs(file_dir, exist_ok=True)
+        folder_path = request.args.get('folder_path', '')
+        path = request.args.get('path', '')
+        block_size = request.args.get('block_size', type=int)
+        if not folder_path or not path or not block_size:
+            return jsonify({'error': 'folder_path, path and block_size are required'}), 400
         
-        # Get sync mode to determine file handling behavior
-        sync_mode = request.form.get('sync_mode', 'COPY_AND_DELETE')
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, request.args.get('hash_algorithm'))
+            target_folder, file_path = resolve_delta_file(folder_path, path)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not os.path.isfile(file_path):
+            return jsonify({'error': 'File not found'}), 404
         
-        # Handle existing files based on sync mode
-        if os.path.exists(file_path):
-            if sync_mode == 'MIRROR' or sync_mode == 'UPDATE':
-                # For Mirror/Update mode, overwrite existing files
-                print(f"🔄 Overwriting existing file: {safe_filename} (Mirror/Update mode)")
-            elif handle_duplicates:
-                # Find the next available dup folder number
-                dup_counter = 1
-                while os.path.exists(os.path.join(target_folder, f"dup{dup_counter}")):
-                    dup_counter += 1
-                
-                # Create the duplicate folder
-                dup_folder = os.path.join(target_folder, f"dup{dup_counter}")
-                os.makedirs(dup_folder, exist_ok=True)
-                
-                # Prepare file names
-                existing_file_name = os.path.basename(file_path)
-                base_name, extension = os.path.splitext(existing_file_name)
-                
-                # Move existing file to duplicate folder with "_existing" suffix
-                existing_new_name = f"{base_name}_existing{extension}"
-                existing_new_path = os.path.join(dup_folder, existing_new_name)
-                
-                try:
-                    import shutil
-                    shutil.move(file_path, existing_new_path)
-                    print(f"📁 Moved existing file to: dup{dup_counter}/{existing_new_name}")
-                except Exception as e:
-                    print(f"⚠️ Could not move existing file: {e}")
-                
-                # Set path for new file with "_new" suffix in the same duplicate folder
-                new_file_name = f"{base_name}_new{extension}"
-                file_path = os.path.join(dup_folder, new_file_name)
-                print(f"📁 Will save new file as: dup{dup_counter}/{new_file_name}")
-                
-            else:
-                # Add counter to filename
-                counter = 1
-                base_name, extension = os.path.splitext(safe_filename)
-                original_file_path = file_path
-                
-                while os.path.exists(file_path):
-                    safe_filename = f"{base_name} ({counter}){extension}"
-                    file_path = os.path.join(target_folder, safe_filename)
-                    counter += 1
+        basis_hash = request.args.get('basis_hash')
+        if basis_hash and get_file_hash(file_path, algorithm=algorithm) != basis_hash.lower():
+            return jsonify({'error': 'File changed since the signature was taken'}), 409
         
-        # Save file
         start_time = time.time()
-        file.save(file_path)
-        end_time = time.time()
-        
-        # Get file info
-        file_size = os.path.getsize(file_path)
-        upload_time = end_time - start_time
-        speed = file_size / upload_time if upload_time > 0 else 0
-        
-        # Determine the final filename for logging
-        final_filename = os.path.basename(file_path)
-        if handle_duplicates and "dup" in file_path:
-            dup_folder_name = os.path.basename(os.path.dirname(file_path))
-            print(f"✅ Uploaded to duplicate folder: {dup_folder_name}/{final_filename} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
-        else:
-            print(f"✅ Uploaded: {final_filename} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
-        
+        part_path = os.path.join(os.path.dirname(file_path), f".{uuid.uuid4().hex}{PARTIAL_UPLOAD_SUFFIX}")
+        hasher = HASH_ALGORITHMS[algorithm]()
+        try:
+            file_size = apply_delta(request.stream, file_path, part_path, block_size, hasher)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        file_hash = hasher.hexdigest()
+        
+        file_path, safe_filename, _ = place_upload(part_path, target_folder, create_safe_filename(path), 'MIRROR',
+                                                   False, file_hash, algorithm, request.args.get('checksum'))
+        part_path = None
+        if file_path is None:
+            print(f"❌ Checksum mismatch for delta upload: {path}")
+            return jsonify({'error': 'Checksum mismatch', 'hash': file_hash}), 422
+        
+        received = request.content_length or 0
+        print(f"✅ Rebuilt from delta: {safe_filename} ({file_size} bytes from {received} sent) in {time.time() - start_time:.2f}s")
         return jsonify({
             'success': True,
             'filename': safe_filename,
             'size': file_size,
-            'upload_time': upload_time
+            'hash': file_hash,
+            'hash_algorithm': algorithm
         })
     
     except Exception as e:
-        print(f"❌ Upload error: {e}")
+        print(f"❌ Delta apply error: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+@app.route('/api/delta/compute', methods=['POST'])
+def delta_compute():
+    """Stream a delta that turns the client's copy into the server's file
+    
+    The client posts the signature of its copy (block_size and blocks as
+    returned by /api/delta/signature) and applies the response with the same
+    op format. X-FolderSync-Hash carries the hash of the server file.
+    """
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        path = data.get('path', '')
+        block_size = int(data.get('block_size') or 0)
+        if not folder_path or not path or block_size <= 0:
+            return jsonify({'error': 'folder_path, path and block_size are required'}), 400
+        
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, data.get('hash_algorithm'))
+            target_folder, file_path = resolve_delta_file(folder_path, path)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not os.path.isfile(file_path):
+            return jsonify({'error': 'File not found'}), 404
+        
+        signature = [(int(weak), str(strong).lower()) for weak, strong in data.get('blocks', [])]
+        print(f"🧬 Delta for {path} against {len(signature)} client blocks")
+        
+        response = Response(stream_with_context(generate_delta(file_path, signature, block_size)),
+                            mimetype=DELTA_MIME_TYPE)
+        response.headers['X-FolderSync-Hash'] = get_file_hash(file_path, algorithm=algorithm) or ''
+        response.headers['X-FolderSync-Hash-Algorithm'] = algorithm
+        response.headers['X-FolderSync-Size'] = str(os.path.getsize(file_path))
+        return response
+    except Exception as e:
+        print(f"❌ Delta compute error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def resolve_byte_ranges(ranges, size):
+    """Turn parsed Range header ranges into satisfiable (start, stop) pairs"""
+    resolved = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+    return resolved
+
+def multi_range_response(file_path, ranges, size):
+    """Serve several byte ranges of a file as multipart/byteranges"""
+    boundary = uuid.uuid4().hex
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    headers = [f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+               f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n".encode() for start, stop in ranges]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    
+    def generate():
+        with open(file_path, 'rb') as f:
+            for header, (start, stop) in zip(headers, ranges):
+                yield header
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = f.read(min(remaining, UPLOAD_BUFFER_SIZE))
+                    if not chunk:
+                        break
+                    yield chunk
+                    remaining -= len(chunk)
+        yield closing
+    
+    response = Response(generate(), status=206, mimetype=f'multipart/byteranges; boundary={boundary}')
+    response.content_length = sum(len(header) for header in headers) + sum(stop - start for start, stop in ranges) + len(closing)
+    return response
+
 @app.route('/api/download/<path:filename>')
 def download_file(filename):
-    """Download a file from PC"""
+    """Download a file from PC
+    
+    The ETag is the file's cached content hash (X-FolderSync-Hash-Algorithm
+    names it), or a size/mtime tag while the file has not been hashed yet -
+    hashing inline would read the whole file before the first byte goes out.
+    If-None-Match answers 304 for an unchanged file, and Range (single or
+    multiple) with If-Range resumes a download only while it is the same.
+    """
     try:
         # URL decode the filename to handle special characters like # and +
         import urllib.parse
@@ -381,9 +2774,161 @@ def download_file(filename):
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
         
-        return send_from_directory(target_folder, filename)
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, request.args.get('hash_algorithm'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        stat = os.stat(file_path)
+        file_hash = get_cached_hash(os.path.abspath(file_path), stat, algorithm)
+        etag = file_hash or f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        
+        # werkzeug handles conditionals and single ranges, multiple ranges are served here
+        byte_range = request.range
+        if byte_range and len(byte_range.ranges) > 1:
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            if_range = request.if_range
+            if ((if_range.etag is None or if_range.etag == etag)
+                    and (if_range.date is None or int(stat.st_mtime) <= if_range.date.timestamp())):
+                ranges = resolve_byte_ranges(byte_range.ranges, stat.st_size)
+                if not ranges:
+                    response = Response(status=416)
+                    response.headers['Content-Range'] = f'bytes */{stat.st_size}'
+                    return response
+                print(f"📥 Sending {len(ranges)} ranges of {filename}")
+                response = multi_range_response(file_path, ranges, stat.st_size)
+                response.set_etag(etag)
+                response.headers['Accept-Ranges'] = 'bytes'
+                if file_hash:
+                    response.headers['X-FolderSync-Hash-Algorithm'] = algorithm
+                return response
+        
+        response = send_from_directory(target_folder, filename, etag=etag)
+        if file_hash:
+            response.headers['X-FolderSync-Hash-Algorithm'] = algorithm
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Batch downloads - many files streamed back as one uncompressed tar, built
+# on the fly from PAX headers (long and non-ASCII names survive) and file data
+TAR_BLOCK_SIZE = 512
+TAR_FLUSH_SIZE = 256 * 1024
+BATCH_ERRORS_MEMBER = f"{STATE_FOLDER_NAME}/errors.json"
+
+def tar_member_header(name, size, modified):
+    """PAX tar header for a regular file"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = modified
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape')
+
+def tar_padding(size):
+    """NUL bytes that round a member's data up to a whole tar block"""
+    return b'\0' * (-size % TAR_BLOCK_SIZE)
+
+def generate_tar(files, errors, progress=None):
+    """Yield a tar stream of (name, file_path, stat) entries
+    
+    Each member is exactly the size that was stat'ed; a file that shrinks or
+    vanishes mid-stream is zero-filled and reported in a trailing errors.json.
+    """
+    out = bytearray()
+    for name, file_path, stat in files:
+        out.extend(tar_member_header(name, stat.st_size, stat.st_mtime))
+        remaining = stat.st_size
+        try:
+            with open(file_path, 'rb') as f:
+                while remaining > 0:
+                    chunk = f.read(min(remaining, UPLOAD_BUFFER_SIZE))
+                    if not chunk:
+                        raise OSError('File shrank while sending')
+                    out.extend(chunk)
+                    remaining -= len(chunk)
+                    if len(out) >= TAR_FLUSH_SIZE:
+                        yield bytes(out)
+                        out.clear()
+        except OSError as e:
+            errors.append({'path': name, 'error': str(e)})
+            out.extend(b'\0' * remaining)
+        out.extend(tar_padding(stat.st_size))
+        if progress is not None:
+            progress(stat.st_size)
+        if len(out) >= TAR_FLUSH_SIZE:
+            yield bytes(out)
+            out.clear()
+    
+    if errors:
+        body = json.dumps(errors).encode('utf-8')
+        out.extend(tar_member_header(BATCH_ERRORS_MEMBER, len(body), time.time()))
+        out.extend(body)
+        out.extend(tar_padding(len(body)))
+    out.extend(b'\0' * TAR_BLOCK_SIZE * 2)
+    yield bytes(out)
+
+@app.route('/api/download/batch', methods=['POST'])
+def download_batch():
+    """Stream many files of a folder back as a single uncompressed tar
+    
+    Takes folder_path and paths. Members are named by the requested path;
+    paths that are missing or outside the folder are left out and listed,
+    with any read errors, in a final .foldersync/errors.json member.
+    """
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        paths = data.get('paths', [])
+        if not folder_path or not paths:
+            return jsonify({'error': 'folder_path and paths are required'}), 400
+        
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+        base_prefix = os.path.abspath(SYNC_BASE_FOLDER) + os.sep
+        
+        files = []
+        errors = []
+        total_bytes = 0
+        for path in paths:
+            file_path = os.path.join(target_folder, path)
+            if not os.path.isabs(folder_path) and not os.path.abspath(file_path).startswith(base_prefix):
+                errors.append({'path': path, 'error': 'Invalid file path'})
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                stat = None
+            if stat is None or not stat_module.S_ISREG(stat.st_mode):
+                errors.append({'path': path, 'error': 'File not found'})
+                continue
+            files.append((path.replace('\\', '/'), file_path, stat))
+            total_bytes += stat.st_size
+        
+        print(f"📦 Batch download from '{folder_path}': {len(files)} files ({total_bytes} bytes), {len(errors)} missing")
+        progress_id = request_progress_id()
+        progress = None
+        if progress_id:
+            sent = {'files': 0, 'bytes': 0}
+            
+            def progress(size):
+                sent['files'] += 1
+                sent['bytes'] += size
+                event = 'done' if sent['files'] == len(files) else 'progress'
+                publish_progress(f"progress/{progress_id}", event, {
+                    'files': sent['files'], 'total_files': len(files), 'bytes': sent['bytes'], 'total': total_bytes
+                })
+        response = Response(stream_with_context(generate_tar(files, errors, progress)), mimetype='application/x-tar')
+        response.headers['X-FolderSync-Files'] = str(len(files))
+        response.headers['X-FolderSync-Bytes'] = str(total_bytes)
+        return response
     
     except Exception as e:
+        print(f"❌ Batch download error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/delete/<path:filename>', methods=['DELETE'])
@@ -432,6 +2977,8 @@ def delete_file(filename):
         
         # Delete the file
         os.remove(file_path)
+        invalidate_file_hash(os.path.abspath(file_path))
+        record_change(target_folder, 'deleted', file_path)
         
         print(f"✅ Successfully deleted: {filename} ({file_size} bytes)")
         
@@ -504,6 +3051,8 @@ def delete_multiple_files():
                 
                 file_size = os.path.getsize(file_path)
                 os.remove(file_path)
+                invalidate_file_hash(os.path.abspath(file_path))
+                record_change(target_folder, 'deleted', file_path)
                 
                 deleted_files.append(filename)
                 total_size += file_size
@@ -528,36 +3077,563 @@ def delete_multiple_files():
         print(f"❌ Bulk delete error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Batch file operations - one request applies many rename/move/delete/mkdir/copy
+# ops. Deleted and overwritten files go to a per-batch trash folder first, so
+# an atomic batch can be undone in reverse order when any op fails.
+BATCH_TRASH_FOLDER = os.path.join(STATE_FOLDER, 'trash')
+BATCH_OPS = ('rename', 'move', 'delete', 'mkdir', 'copy')
+
+def move_path(source, destination):
+    """Rename a file or folder, copying across drives when a rename is impossible"""
+    try:
+        os.replace(source, destination)
+    except OSError:
+        shutil.move(source, destination)
+
+def carry_cached_hashes(old_path, new_path, copy=False):
+    """Re-key cached hashes after a rename (same inodes) or a copy, instead of rehashing
+    
+    A moved directory carries the hashes of every file below it.
+    """
+    old_path, new_path = os.path.abspath(old_path), os.path.abspath(new_path)
+    directory = os.path.isdir(new_path)
+    with hash_cache_lock:
+        paths = [old_path] + (cached_paths_under(old_path) if directory else [])
+        entries = [(key[0], key[1], hash_cache[key]) for path in paths for key in cached_hash_keys(path)]
+    if not copy:
+        invalidate_file_hash(old_path, directory)
+    invalidate_file_hash(new_path, directory)
+    
+    records = []
+    for path, algorithm, entry in entries:
+        moved_path = new_path + path[len(old_path):]
+        try:
+            stat = os.stat(moved_path)
+        except OSError:
+            continue
+        if stat.st_size == entry['size']:
+            records.append((moved_path, stat, entry['hash'], algorithm))
+    store_file_hashes(records)
+
+class BatchOperationError(Exception):
+    """An operation in a batch could not be applied"""
+
+def apply_batch_operation(target_folder, operation, trash_folder, undo):
+    """Apply one batch op, appending the steps that reverse it to undo"""
+    def resolve(key):
+        path = operation.get(key)
+        if not path:
+            raise BatchOperationError(f"'{key}' is required")
+        full_path = os.path.abspath(os.path.join(target_folder, path))
+        if not full_path.startswith(os.path.abspath(target_folder) + os.sep):
+            raise BatchOperationError(f"Invalid path: {path}")
+        return full_path
+    
+    def to_trash(path):
+        trash_path = os.path.join(trash_folder, str(len(undo)))
+        os.makedirs(trash_folder, exist_ok=True)
+        move_path(path, trash_path)
+        invalidate_file_hash(path)
+        undo.append(('restore', trash_path, path))
+    
+    def make_parents(path):
+        missing = []
+        parent = os.path.dirname(path)
+        while not os.path.exists(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        for folder in reversed(missing):
+            os.mkdir(folder)
+            undo.append(('rmdir', folder, None))
+    
+    op = operation.get('op')
+    if op not in BATCH_OPS:
+        raise BatchOperationError(f"Unknown op: {op}")
+    path = resolve('path')
+    
+    if op == 'mkdir':
+        if os.path.isdir(path):
+            return
+        make_parents(path)
+        os.mkdir(path)
+        undo.append(('rmdir', path, None))
+        return
+    
+    if not os.path.exists(path):
+        raise BatchOperationError('File not found')
+    
+    if op == 'delete':
+        if os.path.isdir(path):
+            raise BatchOperationError('Cannot delete directory, only files')
+        to_trash(path)
+        record_change(target_folder, 'deleted', path)
+        return
+    
+    destination = resolve('to')
+    if os.path.exists(destination):
+        if not operation.get('overwrite') or os.path.isdir(destination):
+            raise BatchOperationError(f"Destination exists: {operation.get('to')}")
+        to_trash(destination)
+    make_parents(destination)
+    
+    if op == 'copy':
+        if os.path.isdir(path):
+            raise BatchOperationError('Cannot copy directory, only files')
+        # A copy is edited on its own, so never hardlink it to the original
+        if share_file(path, destination, hardlink=False):
+            shutil.copystat(path, destination)
+        else:
+            shutil.copy2(path, destination)
+        carry_cached_hashes(path, destination, copy=True)
+        undo.append(('remove', destination, None))
+        record_change(target_folder, 'added', destination)
+    else:
+        move_path(path, destination)
+        carry_cached_hashes(path, destination)
+        undo.append(('rename', destination, path))
+        record_change(target_folder, 'renamed', destination, path)
+
+def undo_batch(target_folder, undo):
+    """Reverse applied batch steps, newest first, returning the steps that failed"""
+    failures = []
+    for action, path, other in reversed(undo):
+        try:
+            if action == 'restore':
+                move_path(path, other)
+                record_change(target_folder, 'added', other)
+            elif action == 'rename':
+                move_path(path, other)
+                carry_cached_hashes(path, other)
+                record_change(target_folder, 'renamed', other, path)
+            elif action == 'remove':
+                os.remove(path)
+                invalidate_file_hash(os.path.abspath(path))
+                record_change(target_folder, 'deleted', path)
+            elif action == 'rmdir':
+                os.rmdir(path)
+        except OSError as e:
+            print(f"⚠️ Could not undo {action} of {path}: {e}")
+            failures.append({'action': action, 'path': path, 'target': other, 'error': str(e)})
+    return failures
+
+def remove_empty_parents(target_folder, paths):
+    """Remove directories left empty by a batch, deepest first, stopping at the folder"""
+    root = os.path.abspath(target_folder)
+    candidates = set()
+    for path in paths:
+        parent = os.path.dirname(os.path.abspath(path))
+        while parent.startswith(root + os.sep):
+            candidates.add(parent)
+            parent = os.path.dirname(parent)
+    removed = 0
+    for folder in sorted(candidates, key=len, reverse=True):
+        try:
+            if not os.listdir(folder):
+                os.rmdir(folder)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+@app.route('/api/batch', methods=['POST'])
+def batch_operations():
+    """Apply a list of file operations to one folder in order
+    
+    Body: folder_path, operations [{'op': rename|move|delete|mkdir|copy,
+    'path', 'to', 'overwrite'}], atomic (default true - the first failure
+    undoes every applied op) and cleanup_empty_dirs (default true - run once
+    after the batch). The folder is held like a sync job while the batch runs.
+    """
+    try:
+        data = request.get_json()
+        folder_path = data.get('folder_path', '')
+        operations = data.get('operations', [])
+        atomic = str(data.get('atomic', 'true')).lower() == 'true'
+        cleanup = str(data.get('cleanup_empty_dirs', 'true')).lower() == 'true'
+        
+        if not folder_path or not operations:
+            return jsonify({'error': 'folder_path and operations are required'}), 400
+        
+        if os.path.isabs(folder_path):
+            target_folder = folder_path
+        else:
+            target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+            if not os.path.abspath(target_folder).startswith(os.path.abspath(SYNC_BASE_FOLDER) + os.sep):
+                return jsonify({'error': 'Invalid folder path'}), 400
+        if not os.path.isdir(target_folder):
+            return jsonify({'error': 'Folder not found'}), 404
+        
+        folder_key = os.path.abspath(target_folder)
+        with sync_queue_cond:
+            sync_queue_cond.wait_for(lambda: folder_key not in sync_busy_folders)
+            sync_busy_folders.add(folder_key)
+        
+        batch_id = uuid.uuid4().hex
+        trash_folder = os.path.join(BATCH_TRASH_FOLDER, batch_id)
+        results = []
+        undo = []
+        undo_errors = []
+        touched = []
+        failed = False
+        try:
+            for index, operation in enumerate(operations):
+                result = {'index': index, 'op': operation.get('op'), 'path': operation.get('path')}
+                if failed and atomic:
+                    result['status'] = 'skipped'
+                    results.append(result)
+                    continue
+                
+                steps = len(undo)
+                try:
+                    apply_batch_operation(target_folder, operation, trash_folder, undo)
+                    result['status'] = 'ok'
+                    touched.append(os.path.join(target_folder, operation.get('path', '')))
+                except (BatchOperationError, OSError) as e:
+                    undo_errors += undo_batch(target_folder, undo[steps:])
+                    del undo[steps:]
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                    failed = True
+                results.append(result)
+            
+            if failed and atomic:
+                undo_errors += undo_batch(target_folder, undo)
+                for result in results:
+                    if result['status'] == 'ok':
+                        result['status'] = 'rolled_back'
+                touched = []
+            
+            removed_dirs = remove_empty_parents(target_folder, touched) if cleanup else 0
+        finally:
+            # Files a failed undo could not restore are only left in the trash
+            if undo_errors:
+                print(f"⚠️ Batch {batch_id}: {len(undo_errors)} undo steps failed, keeping {trash_folder}")
+            else:
+                shutil.rmtree(trash_folder, ignore_errors=True)
+            with sync_queue_cond:
+                sync_busy_folders.discard(folder_key)
+                sync_queue_cond.notify_all()
+        
+        summary = {status: sum(1 for result in results if result['status'] == status)
+                   for status in ('ok', 'error', 'rolled_back', 'skipped')}
+        print(f"📋 Batch on '{folder_path}': {len(operations)} ops, {summary['ok']} applied, "
+              f"{summary['error']} failed, {summary['rolled_back']} rolled back, {removed_dirs} empty folders removed")
+        
+        result = {
+            'success': not failed,
+            'results': results,
+            'summary': summary,
+            'removed_dirs': removed_dirs
+        }
+        if undo_errors:
+            # Not everything was rolled back - the originals are still in the trash
+            result['undo_errors'] = undo_errors
+            result['trash_folder'] = trash_folder
+        return jsonify(result)
+    
+    except Exception as e:
+        print(f"❌ Batch error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Sync planning - the client posts its manifest and gets back every action
+# in one response, decided with the same rules as the Android client's
+# compareAndFilterFiles plus the server's hash cache
+SYNC_PROGRESS_INTERVAL = 500  # Files between sync_status progress updates
+
+def client_file_mtime(entry):
+    """Client mtime in seconds - 'modified' in seconds or Android's 'last_modified' in ms"""
+    if entry.get('modified') is not None:
+        return float(entry['modified'])
+    if entry.get('last_modified') is not None:
+        return float(entry['last_modified']) / 1000
+    return 0.0
+
+def plan_folder_sync(target_folder, client_files, direction, sync_mode, algorithm=DEFAULT_HASH_ALGORITHM,
+                     progress=None):
+    """Diff a client manifest against a server folder and return the action plan
+    
+    New files are copied; a file whose size or mtime (beyond MTIME_TOLERANCE)
+    differs is updated only when the source side is newer. Equal sizes with
+    matching hashes count as identical whatever the mtimes. MIRROR also
+    deletes destination files the source no longer has, and COPY_AND_DELETE
+    copies everything except files already identical at the destination,
+    which are listed under 'identical' so the source copy can be removed.
+    """
+    server_files = {}
+    if os.path.isdir(target_folder):
+        for entry in scan_directory(target_folder):
+            server_files[entry['path']] = {'path': entry['path'], 'size': entry['size'], 'modified': entry['modified']}
+    
+    # Client names go through the same sanitising as uploads to line up with server names
+    client = {}
+    for entry in client_files:
+        path = str(entry.get('path', '')).replace('\\', '/')
+        if path:
+            client[create_safe_filename(path)] = {
+                'path': path,
+                'size': int(entry.get('size', 0)),
+                'modified': client_file_mtime(entry),
+                'hash': str(entry.get('hash') or '').lower() or None
+            }
+    
+    def same_content(key, client_entry, server_entry):
+        if client_entry['size'] != server_entry['size']:
+            return False
+        if abs(client_entry['modified'] - server_entry['modified']) <= MTIME_TOLERANCE:
+            return True
+        return (client_entry['hash'] is not None and
+                client_entry['hash'] == get_file_hash(os.path.join(target_folder, key), algorithm=algorithm))
+    
+    to_server = direction == 'ANDROID_TO_PC'
+    source, destination = (client, server_files) if to_server else (server_files, client)
+    copy_action, delete_action = ('upload', 'delete') if to_server else ('download', 'delete_local')
+    plan = {copy_action: [], 'update': [], delete_action: [], 'identical': [], 'skipped': 0, 'bytes': 0}
+    total = len(source) + len(destination)
+    
+    for index, (key, source_entry) in enumerate(source.items()):
+        destination_entry = destination.get(key)
+        if destination_entry is None:
+            plan[copy_action].append(source_entry['path'])
+            plan['bytes'] += source_entry['size']
+        elif same_content(key, *((source_entry, destination_entry) if to_server else (destination_entry, source_entry))):
+            if sync_mode == 'COPY_AND_DELETE':
+                plan['identical'].append(source_entry['path'])
+            plan['skipped'] += 1
+        elif sync_mode == 'COPY_AND_DELETE':
+            plan[copy_action].append(source_entry['path'])
+            plan['bytes'] += source_entry['size']
+        elif source_entry['modified'] > destination_entry['modified']:
+            plan['update'].append(source_entry['path'])
+            plan['bytes'] += source_entry['size']
+        else:
+            plan['skipped'] += 1  # Destination is newer
+        
+        if progress and index % SYNC_PROGRESS_INTERVAL == 0:
+            progress(index, total)
+    
+    if sync_mode == 'MIRROR':
+        for key, destination_entry in destination.items():
+            if key not in source:
+                plan[delete_action].append(destination_entry['path'])
+    
+    if progress:
+        progress(total, total)
+    return plan
+
+def remove_synced_file(target_folder, file_path):
+    """Delete a file, journal it and drop its parent directory if now empty"""
+    os.remove(file_path)
+    invalidate_file_hash(os.path.abspath(file_path))
+    record_change(target_folder, 'deleted', file_path)
+    
+    parent_dir = os.path.dirname(file_path)
+    try:
+        if os.path.abspath(parent_dir) != os.path.abspath(target_folder) and not os.listdir(parent_dir):
+            os.rmdir(parent_dir)
+    except OSError:
+        pass
+
+def sync_folder(folder, algorithm_override=None, progress=None):
+    """Plan one folder entry of a sync request, applying server-side deletes if asked"""
+    folder_path = folder.get('folder_path') or folder.get('name', '')
+    if not folder_path:
+        raise ValueError('folder_path is required')
+    direction = folder.get('direction', 'ANDROID_TO_PC')
+    if direction not in ('ANDROID_TO_PC', 'PC_TO_ANDROID'):
+        raise ValueError(f"Unsupported direction: {direction}")
+    sync_mode = folder.get('sync_mode', 'MIRROR')
+    algorithm = resolve_hash_algorithm(folder_path, folder.get('hash_algorithm') or algorithm_override)
+    
+    if os.path.isabs(folder_path):
+        target_folder = folder_path
+    else:
+        target_folder = os.path.join(SYNC_BASE_FOLDER, folder_path)
+    os.makedirs(target_folder, exist_ok=True)
+    
+    plan = plan_folder_sync(target_folder, folder.get('files', []), direction, sync_mode, algorithm, progress)
+    plan['folder_path'] = folder_path
+    plan['direction'] = direction
+    plan['sync_mode'] = sync_mode
+    
+    # Deleting server files for a phone-to-PC mirror needs no data from the phone
+    if plan.get('delete') and str(folder.get('apply_deletes', 'false')).lower() == 'true':
+        deleted, errors = [], []
+        for path in plan['delete']:
+            try:
+                remove_synced_file(target_folder, os.path.join(target_folder, path))
+                deleted.append(path)
+            except OSError as e:
+                errors.append({'path': path, 'error': str(e)})
+        deleted_set = set(deleted)
+        plan['delete'] = [path for path in plan['delete'] if path not in deleted_set]
+        plan['deleted'] = deleted
+        plan['delete_errors'] = errors
+    
+    print(f"🧭 Plan for '{folder_path}' ({direction}, {sync_mode}): "
+          f"{len(plan.get('upload', plan.get('download', [])))} to copy, {len(plan['update'])} to update, "
+          f"{len(plan.get('delete', plan.get('delete_local', [])))} to delete, {plan['skipped']} skipped")
+    return plan
+
+@app.route('/api/sync/plan', methods=['POST'])
+def sync_plan():
+    """Diff a client manifest against a folder and return the action plan
+    
+    Body: folder_path, direction (ANDROID_TO_PC or PC_TO_ANDROID), sync_mode
+    (MIRROR, SYNC/UPDATE or COPY_AND_DELETE), files [{path, size, modified or
+    last_modified, hash}] and optionally apply_deletes to remove server files
+    a phone-to-PC mirror no longer has.
+    """
+    try:
+        data = request.get_json()
+        try:
+            plan = sync_folder(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(plan)
+    except Exception as e:
+        print(f"❌ Sync plan error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Sync jobs - a fixed pool of workers takes queued jobs by priority, never
+# runs two jobs that share a folder at once, and finished job records are
+# evicted after SYNC_JOB_TTL. Job payloads (client manifests) are kept apart
+# from sync_status so status polling stays cheap.
+SYNC_WORKERS = 4
+SYNC_JOB_TTL = 3600  # Seconds a finished job's status stays queryable
+SYNC_FINISHED_STATES = ('completed', 'error', 'cancelled')
+
+sync_queue = []  # Heap of (-priority, sequence, sync_id)
+sync_queue_cond = threading.Condition()
+sync_jobs = {}  # sync_id -> {'folders': [...], 'folder_keys': set(), 'running': bool}
+sync_busy_folders = set()
+sync_workers = []
+sync_sequence = 0
+
+SYNC_EVENT_FIELDS = ('status', 'progress', 'current_folder', 'completed_folders', 'total_folders', 'errors')
+
+def publish_sync_status(sync_id):
+    """Push the small fields of a sync's status to its event stream"""
+    with sync_lock:
+        status = sync_status.get(sync_id)
+        if status is None:
+            return
+        snapshot = {key: status[key] for key in SYNC_EVENT_FIELDS}
+        snapshot['errors'] = list(snapshot['errors'])
+    event = snapshot['status'] if snapshot['status'] in PROGRESS_FINAL_EVENTS else 'progress'
+    publish_progress(f"sync/{sync_id}", event, snapshot)
+
+class SyncCancelled(Exception):
+    """Raised inside a running job once its cancellation was requested"""
+
+def sync_folder_key(folder):
+    """Absolute path a sync job entry works on, for per-folder serialization"""
+    folder_path = folder.get('folder_path') or folder.get('name', '')
+    if os.path.isabs(folder_path):
+        return os.path.abspath(folder_path)
+    return os.path.abspath(os.path.join(SYNC_BASE_FOLDER, folder_path))
+
+def expire_sync_jobs():
+    """Drop status records of jobs that finished more than SYNC_JOB_TTL ago"""
+    cutoff = time.time() - SYNC_JOB_TTL
+    with sync_lock:
+        for sync_id in [sync_id for sync_id, status in sync_status.items()
+                        if status['status'] in SYNC_FINISHED_STATES and status.get('end_time', 0) < cutoff]:
+            del sync_status[sync_id]
+
+def start_sync_workers():
+    """Start the worker pool on first use (in the serving process, after any fork)"""
+    with sync_queue_cond:
+        while len(sync_workers) < SYNC_WORKERS:
+            worker = threading.Thread(target=sync_worker, name=f'sync-{len(sync_workers)}', daemon=True)
+            sync_workers.append(worker)
+            worker.start()
+
+def next_sync_job():
+    """Block until a queued job whose folders are all free can run (sync_queue_cond held)"""
+    while True:
+        skipped = []
+        job = None
+        while sync_queue:
+            entry = heapq.heappop(sync_queue)
+            sync_id = entry[2]
+            if sync_id not in sync_jobs:
+                continue  # Cancelled while queued
+            if sync_jobs[sync_id]['folder_keys'] & sync_busy_folders:
+                skipped.append(entry)
+                continue
+            job = sync_id
+            break
+        for entry in skipped:
+            heapq.heappush(sync_queue, entry)
+        if job is not None:
+            sync_busy_folders.update(sync_jobs[job]['folder_keys'])
+            sync_jobs[job]['running'] = True
+            return job
+        sync_queue_cond.wait()
+
+def sync_worker():
+    """Run queued sync jobs forever"""
+    while True:
+        with sync_queue_cond:
+            sync_id = next_sync_job()
+            job = sync_jobs[sync_id]
+        try:
+            perform_sync(sync_id, job['folders'])
+        finally:
+            with sync_queue_cond:
+                sync_busy_folders.difference_update(job['folder_keys'])
+                sync_jobs.pop(sync_id, None)
+                sync_queue_cond.notify_all()
+
 @app.route('/api/sync/start', methods=['POST'])
 def start_sync():
-    """Start synchronization process"""
+    """Queue planning a sync of several folders (see /api/sync/plan)
+    
+    Higher 'priority' jobs start first; jobs sharing a folder run one at a time.
+    """
+    global sync_sequence
     try:
         data = request.get_json()
-        sync_id = data.get('sync_id', str(int(time.time())))
+        sync_id = data.get('sync_id', uuid.uuid4().hex)
         folders = data.get('folders', [])
+        priority = int(data.get('priority', 0))
         
         if not folders:
             return jsonify({'error': 'No folders provided'}), 400
         
+        expire_sync_jobs()
         with sync_lock:
+            if sync_id in sync_status and sync_status[sync_id]['status'] not in SYNC_FINISHED_STATES:
+                return jsonify({'error': f'Sync {sync_id} is already running'}), 409
             sync_status[sync_id] = {
-                'status': 'started',
-                'folders': folders,
+                'status': 'queued',
+                'priority': priority,
+                'folders': [folder.get('folder_path') or folder.get('name', '') for folder in folders],
                 'progress': 0,
                 'current_folder': '',
-                'start_time': time.time(),
+                'queued_time': time.time(),
                 'completed_folders': 0,
                 'total_folders': len(folders),
+                'plans': {},
                 'errors': []
             }
         
-        # Start sync in background thread
-        threading.Thread(target=perform_sync, args=(sync_id, folders)).start()
+        publish_sync_status(sync_id)
+        start_sync_workers()
+        with sync_queue_cond:
+            sync_jobs[sync_id] = {
+                'folders': folders,
+                'folder_keys': {sync_folder_key(folder) for folder in folders},
+                'running': False
+            }
+            sync_sequence += 1
+            heapq.heappush(sync_queue, (-priority, sync_sequence, sync_id))
+            sync_queue_cond.notify_all()
         
         return jsonify({
             'sync_id': sync_id,
-            'status': 'started',
-            'message': f'Sync started for {len(folders)} folders'
+            'status': 'queued',
+            'message': f'Sync queued for {len(folders)} folders'
         })
     
     except Exception as e:
@@ -566,33 +3642,92 @@ def start_sync():
 @app.route('/api/sync/status/<sync_id>')
 def get_sync_status(sync_id):
     """Get synchronization status"""
+    expire_sync_jobs()
     with sync_lock:
-        status = sync_status.get(sync_id, {'status': 'not_found'})
+        status = dict(sync_status.get(sync_id, {'status': 'not_found'}))
+        # Copied so a worker can keep updating the record while it is serialized
+        for key in ('plans', 'errors'):
+            if key in status:
+                status[key] = type(status[key])(status[key])
     
     return jsonify(status)
 
+@app.route('/api/sync/events/<sync_id>')
+def sync_events(sync_id):
+    """SSE stream of a sync's progress, ending with completed, error or cancelled"""
+    with sync_lock:
+        if sync_id not in sync_status:
+            return jsonify({'error': 'Sync not found'}), 404
+    if get_progress_channel(f"sync/{sync_id}")['version'] == 0:
+        publish_sync_status(sync_id)
+    return progress_response(f"sync/{sync_id}", f"/api/sync/status/{sync_id}")
+
+@app.route('/api/sync/<sync_id>', methods=['DELETE'])
+def cancel_sync(sync_id):
+    """Cancel a queued sync, or stop a running one at its next progress check"""
+    with sync_queue_cond:
+        queued = sync_id in sync_jobs and not sync_jobs[sync_id]['running']
+        with sync_lock:
+            status = sync_status.get(sync_id)
+            if status is None:
+                return jsonify({'error': 'Sync not found'}), 404
+            if status['status'] in SYNC_FINISHED_STATES:
+                return jsonify({'error': f"Sync already {status['status']}"}), 409
+            if queued:
+                sync_jobs.pop(sync_id, None)
+                status['status'] = 'cancelled'
+                status['end_time'] = time.time()
+            else:
+                status['cancel_requested'] = True
+    
+    publish_sync_status(sync_id)
+    print(f"🛑 Cancel requested for sync {sync_id}")
+    return jsonify({'sync_id': sync_id, 'status': status['status']})
+
 def perform_sync(sync_id, folders):
-    """Perform the actual synchronization (background task)"""
+    """Plan each folder of a sync (run by a sync worker), reporting through sync_status"""
+    def check_cancelled():
+        with sync_lock:
+            if sync_status[sync_id].get('cancel_requested'):
+                raise SyncCancelled()
+    
     try:
+        check_cancelled()
         with sync_lock:
             sync_status[sync_id]['status'] = 'syncing'
+            sync_status[sync_id]['start_time'] = time.time()
         
         for i, folder in enumerate(folders):
-            folder_name = folder.get('name', f'folder_{i}')
+            check_cancelled()
+            folder_name = folder.get('folder_path') or folder.get('name', f'folder_{i}')
             
             with sync_lock:
                 sync_status[sync_id]['current_folder'] = folder_name
                 sync_status[sync_id]['progress'] = i / len(folders)
+            publish_sync_status(sync_id)
             
-            # Simulate sync work (replace with actual sync logic)
-            time.sleep(2)  # Simulate processing time
+            def progress(done, total):
+                with sync_lock:
+                    sync_status[sync_id]['progress'] = (i + (done / total if total else 1)) / len(folders)
+                    cancelled = sync_status[sync_id].get('cancel_requested')
+                if cancelled:
+                    raise SyncCancelled()
+                publish_sync_status(sync_id)
             
-            # Create folder if it doesn't exist
-            folder_path = os.path.join(SYNC_BASE_FOLDER, folder_name)
-            os.makedirs(folder_path, exist_ok=True)
+            try:
+                plan = sync_folder(folder, progress=progress)
+                with sync_lock:
+                    sync_status[sync_id]['plans'][folder_name] = plan
+            except SyncCancelled:
+                raise
+            except Exception as e:
+                with sync_lock:
+                    sync_status[sync_id]['errors'].append(f"{folder_name}: {e}")
+                print(f"⚠️ Sync {sync_id} could not plan {folder_name}: {e}")
             
             with sync_lock:
                 sync_status[sync_id]['completed_folders'] = i + 1
+            publish_sync_status(sync_id)
         
         # Mark as completed
         with sync_lock:
@@ -601,13 +3736,24 @@ def perform_sync(sync_id, folders):
             sync_status[sync_id]['end_time'] = time.time()
             sync_status[sync_id]['current_folder'] = ''
         
+        publish_sync_status(sync_id)
         print(f"✅ Sync {sync_id} completed successfully")
     
+    except SyncCancelled:
+        with sync_lock:
+            sync_status[sync_id]['status'] = 'cancelled'
+            sync_status[sync_id]['end_time'] = time.time()
+            sync_status[sync_id]['current_folder'] = ''
+        publish_sync_status(sync_id)
+        print(f"🛑 Sync {sync_id} cancelled")
+    
     except Exception as e:
         with sync_lock:
             sync_status[sync_id]['status'] = 'error'
             sync_status[sync_id]['errors'].append(str(e))
+            sync_status[sync_id]['end_time'] = time.time()
         
+        publish_sync_status(sync_id)
         print(f"❌ Sync {sync_id} failed: {e}")
 
 @app.route('/api/health')
@@ -616,22 +3762,76 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'sync_base_folder': SYNC_BASE_FOLDER
+        'sync_base_folder': SYNC_BASE_FOLDER,
+        'hash_algorithms': sorted(HASH_ALGORITHMS),
+        'default_hash_algorithm': DEFAULT_HASH_ALGORITHM,
+        'dedup_mode': DEDUP_MODE
     })
 
+# Serving - 'auto' prefers gunicorn, whose wsgi.file_wrapper sends downloads
+# with os.sendfile (kernel to socket), then the Flask dev server. waitress is
+# only used when asked for: it buffers each request body before calling the
+# app, so streamed uploads are spooled twice and their progress events only
+# arrive at the end, and it has no sendfile. On Windows (no gunicorn) prefer
+# sync_server_async.py.
+# Upload sessions, sync status and the live index live in this process, so
+# gunicorn runs a single worker with many threads rather than several workers.
+SERVER_MODE = os.environ.get('FOLDERSYNC_SERVER', 'auto').lower()
+SERVER_PORT = int(os.environ.get('FOLDERSYNC_PORT', '5016'))
+SERVER_THREADS = 32
+
+def run_server(host, port):
+    """Serve the app with the best server available for SERVER_MODE"""
+    if SERVER_MODE in ('auto', 'gunicorn'):
+        try:
+            from gunicorn.app.base import BaseApplication
+            
+            class GunicornServer(BaseApplication):
+                def load_config(self):
+                    self.cfg.set('bind', f"{host}:{port}")
+                    self.cfg.set('workers', 1)
+                    self.cfg.set('worker_class', 'gthread')
+                    self.cfg.set('threads', SERVER_THREADS)
+                    self.cfg.set('timeout', 300)
+                    self.cfg.set('sendfile', True)
+                    # Background threads do not survive the fork, so start them in the worker
+                    self.cfg.set('post_worker_init', lambda worker: start_folder_watcher())
+                
+                def load(self):
+                    return app
+            
+            print(f"🦄 Serving with gunicorn ({SERVER_THREADS} threads, sendfile downloads)")
+            GunicornServer().run()
+            return
+        except ImportError:
+            if SERVER_MODE == 'gunicorn':
+                print(f"⚠️ gunicorn is not installed, falling back")
+    
+    start_folder_watcher()
+    if SERVER_MODE == 'waitress':
+        try:
+            from waitress import serve
+            print(f"🍽️ Serving with waitress ({SERVER_THREADS} threads, request bodies are buffered before upload handlers run)")
+            serve(app, host=host, port=port, threads=SERVER_THREADS)
+            return
+        except ImportError:
+            print(f"⚠️ waitress is not installed, falling back")
+    
+    print(f"🐢 Serving with the Flask development server")
+    app.run(
+        host=host, 
+        port=port, 
+        debug=False,  # Disable debug for better performance
+        threaded=True,  # Enable threading for concurrent requests
+        use_reloader=False  # Disable auto-reloader for stability
+    )
+
 if __name__ == "__main__":
     print(f"🚀 Folder Sync Server starting...")
     print(f"📁 Sync base folder: {SYNC_BASE_FOLDER}")
-    print(f"🌐 Server will be available at: http://localhost:5016")
+    print(f"🌐 Server will be available at: http://localhost:{SERVER_PORT}")
     print(f"💡 Make sure your Android device is on the same network")
     print(f"🔄 Features: Upload, Download, Delete (Mirror mode supported)")
     print(f"🗑️ Mirror mode will add/remove files to keep folders identical")
     
-    # Optimized server settings for better performance
-    app.run(
-        host="0.0.0.0", 
-        port=5016, 
-        debug=False,  # Disable debug for better performance
-        threaded=True,  # Enable threading for concurrent requests
-        use_reloader=False  # Disable auto-reloader for stability
-    )
\ No newline at end of file
+    run_server("0.0.0.0", SERVER_PORT)
@@ -0,0 +1,387 @@
+"""
+Asyncio (ASGI) variant of sync_server.py
+
+Serves the same /api/* routes on an event loop instead of one thread per
+connection, so thousands of slow phone uploads cost a coroutine each rather
+than a thread each. The transfer routes run natively here:
+
+    POST|PUT /api/upload/stream            request body streamed without blocking
+    PUT      /api/upload/sessions/<id>     resumable upload chunks
+    GET      /api/download/<path>          FileResponse (Range, multiple ranges, If-Range)
+    GET      /api/health
+    GET      .../events                    SSE progress streams
+
+File writes and hashing run on a bounded pool of IO_WORKERS threads. Each
+request keeps at most one buffer in flight and only reads more of its body
+once that write has finished, and uvicorn stops reading a socket whose body
+is not being consumed - a slow disk slows the senders instead of filling
+memory. Every other route is the Flask app from sync_server.py, run through
+a2wsgi, so behaviour and state (sessions, sync jobs, hash index) are shared.
+
+Requires: pip install uvicorn starlette a2wsgi
+
+Usage:
+    python sync_server_async.py
+    uvicorn sync_server_async:app --host 0.0.0.0 --port 5016
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import urllib.parse
+import stat as stat_module
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, FileResponse, StreamingResponse
+from starlette.routing import Route, Mount
+
+import sync_server
+from sync_server import (
+    SYNC_BASE_FOLDER, HASH_ALGORITHMS, DEFAULT_HASH_ALGORITHM, DEDUP_MODE, PARTIAL_UPLOAD_SUFFIX,
+    UPLOAD_BUFFER_SIZE, PROGRESS_MIN_INTERVAL, PROGRESS_KEEPALIVE, PROGRESS_FINAL_EVENTS,
+    SERVER_PORT, SERVER_THREADS, sync_lock, sync_status,
+    resolve_hash_algorithm, create_safe_filename, get_cached_hash, place_upload,
+    get_upload_session, upload_session_paths, write_chunk_at, session_info,
+    claim_inline_hash, release_inline_hash, record_session_chunk,
+    get_progress_channel, publish_progress, publish_sync_status, start_folder_watcher
+)
+
+IO_WORKERS = 16  # Threads doing file writes and hashing for the native routes
+BUFFER_MAX_AGE = 0.05  # Seconds a slow sender's bytes may wait to fill a buffer
+
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='foldersync-io')
+
+def run_io(func, *args, **kwargs):
+    """Run blocking file work on the bounded IO pool"""
+    return asyncio.get_running_loop().run_in_executor(io_executor, partial(func, *args, **kwargs))
+
+async def buffered_body(request):
+    """Yield the request body in buffers of up to UPLOAD_BUFFER_SIZE
+
+    The next piece is only read once the caller has finished with the last
+    buffer, which is what pushes back on a sender that outruns the disk.
+    Slow senders are flushed after BUFFER_MAX_AGE instead of filling a whole
+    buffer, so idle connections do not each hold a megabyte.
+    """
+    pending = []
+    pending_size = 0
+    pending_since = 0.0
+    async for piece in request.stream():
+        if not piece:
+            continue
+        if not pending:
+            pending_since = time.monotonic()
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= UPLOAD_BUFFER_SIZE or time.monotonic() - pending_since >= BUFFER_MAX_AGE:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield b''.join(pending)
+
+def write_and_hash(write, data, hashers):
+    """Write a buffer and feed it to each hasher (hashlib releases the GIL on large buffers)"""
+    write(data)
+    for hasher in hashers:
+        hasher.update(data)
+
+def request_progress_id(request):
+    """Client-chosen progress id of this request (X-Progress-Id header or progress_id query parameter)"""
+    return request.headers.get('X-Progress-Id') or request.query_params.get('progress_id')
+
+def resolve_target_folder(folder_path):
+    """Absolute folder paths are used as-is, relative ones live under the sync base folder"""
+    if os.path.isabs(folder_path):
+        return folder_path
+    return os.path.join(SYNC_BASE_FOLDER, folder_path)
+
+async def upload_file_stream(request):
+    """Upload a file sent as the raw request body (same parameters as the Flask route)"""
+    part_path = None
+    progress_id = None
+    try:
+        progress_id = request_progress_id(request)
+        args = request.query_params
+        folder_path = args.get('folder_path', '')
+        original_filename = args.get('original_filename', '') or request.headers.get('X-Filename', '')
+        handle_duplicates = args.get('handle_duplicates', 'true').lower() == 'true'
+        sync_mode = args.get('sync_mode', 'COPY_AND_DELETE')
+
+        if not folder_path or not original_filename:
+            return JSONResponse({'error': 'folder_path and original_filename are required'}, status_code=400)
+
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, args.get('hash_algorithm'))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        content_length = request.headers.get('Content-Length')
+        content_length = int(content_length) if content_length and content_length.isdigit() else None
+
+        safe_filename = create_safe_filename(original_filename)
+        target_folder = resolve_target_folder(folder_path)
+        file_dir = os.path.dirname(os.path.join(target_folder, safe_filename))
+        await run_io(os.makedirs, file_dir, exist_ok=True)
+
+        start_time = time.time()
+        part_path = os.path.join(file_dir, f".{uuid.uuid4().hex}{PARTIAL_UPLOAD_SUFFIX}")
+        hasher = HASH_ALGORITHMS[algorithm]()
+        file_size = 0
+        f = await run_io(open, part_path, 'wb')
+        try:
+            async for buffer in buffered_body(request):
+                await run_io(write_and_hash, f.write, buffer, (hasher,))
+                file_size += len(buffer)
+                if progress_id:
+                    publish_progress(f"progress/{progress_id}", 'progress', {'bytes': file_size, 'total': content_length})
+        finally:
+            await run_io(f.close)
+
+        if content_length is not None and file_size != content_length:
+            return JSONResponse({'error': f'Incomplete upload: got {file_size} of {content_length} bytes'}, status_code=400)
+
+        file_hash = hasher.hexdigest()
+        expected_hash = args.get('checksum') or request.headers.get('X-Content-Hash')
+        file_path, safe_filename, deduplicated = await run_io(
+            place_upload, part_path, target_folder, safe_filename, sync_mode,
+            handle_duplicates, file_hash, algorithm, expected_hash)
+        part_path = None
+        if file_path is None:
+            print(f"❌ Checksum mismatch for stream upload: {original_filename}")
+            return JSONResponse({'error': 'Checksum mismatch', 'hash': file_hash}, status_code=422)
+
+        upload_time = time.time() - start_time
+        speed = file_size / upload_time if upload_time > 0 else 0
+        print(f"✅ Uploaded (async stream): {os.path.basename(file_path)} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
+
+        result = {
+            'success': True,
+            'filename': safe_filename,
+            'size': file_size,
+            'upload_time': upload_time,
+            'hash': file_hash,
+            'hash_algorithm': algorithm,
+            'deduplicated': deduplicated
+        }
+        if progress_id:
+            publish_progress(f"progress/{progress_id}", 'done', result)
+        return JSONResponse(result)
+
+    except Exception as e:
+        print(f"❌ Stream upload error: {e}")
+        if progress_id:
+            publish_progress(f"progress/{progress_id}", 'error', {'error': str(e)})
+        return JSONResponse({'error': str(e)}, status_code=500)
+    finally:
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+async def upload_session_chunk(request):
+    """Write one chunk at ?offset=N, verified against an optional X-Chunk-Hash (MD5)"""
+    upload_id = request.path_params['upload_id']
+    try:
+        session = await run_io(get_upload_session, upload_id)
+        if session is None:
+            return JSONResponse({'error': 'Upload session not found'}, status_code=404)
+
+        try:
+            offset = int(request.query_params.get('offset', ''))
+        except ValueError:
+            offset = None
+        if offset is None or offset < 0 or offset > session['size']:
+            return JSONResponse({'error': 'Valid offset is required'}, status_code=400)
+        expected_hash = request.headers.get('X-Chunk-Hash', '').lower()
+
+        inline = claim_inline_hash(session, offset)
+        _, part_path = upload_session_paths(upload_id)
+        hasher = hashlib.md5()
+        hashers = (hasher, session['_hasher']) if inline else (hasher,)
+        length = 0
+        chunk_ok = False
+        fd = await run_io(os.open, part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            async for buffer in buffered_body(request):
+                if offset + length + len(buffer) > session['size']:
+                    return JSONResponse({'error': 'Chunk extends past the declared file size'}, status_code=400)
+                write = partial(write_chunk_at, fd, session, position=offset + length)
+                await run_io(write_and_hash, write, buffer, hashers)
+                length += len(buffer)
+
+            chunk_hash = hasher.hexdigest()
+            chunk_ok = not expected_hash or expected_hash == chunk_hash
+        finally:
+            os.close(fd)
+            release_inline_hash(session, inline, length, chunk_ok)
+
+        if not chunk_ok:
+            print(f"⚠️ Chunk checksum mismatch for {upload_id} at offset {offset}")
+            return JSONResponse({'error': 'Chunk checksum mismatch', 'hash': chunk_hash}, status_code=422)
+
+        info = await run_io(record_session_chunk, session, offset, length, chunk_hash)
+        return JSONResponse(info)
+    except Exception as e:
+        print(f"❌ Upload chunk error: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+def etag_matches(header, etag):
+    """Whether an If-None-Match header lists this (quoted) ETag, weakly compared"""
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+async def download_file(request):
+    """Download a file, with the cached content hash (or a size/mtime tag) as ETag
+
+    FileResponse answers Range (single or multiple) and If-Range itself,
+    If-None-Match is answered here.
+    """
+    try:
+        # Same extra decoding step as the Flask route, clients rely on it for # and +
+        filename = urllib.parse.unquote(request.path_params['filename'])
+        folder_path = request.query_params.get('folder_path', '')
+        if not folder_path:
+            return JSONResponse({'error': 'folder_path is required'}, status_code=400)
+
+        target_folder = resolve_target_folder(folder_path)
+        file_path = os.path.join(target_folder, filename)
+        if not os.path.isabs(folder_path):
+            if not os.path.abspath(file_path).startswith(os.path.abspath(SYNC_BASE_FOLDER)):
+                return JSONResponse({'error': 'Invalid file path'}, status_code=400)
+
+        try:
+            stat = await run_io(os.stat, file_path)
+        except OSError:
+            stat = None
+        if stat is None or not stat_module.S_ISREG(stat.st_mode):
+            return JSONResponse({'error': 'File not found'}, status_code=404)
+
+        try:
+            algorithm = resolve_hash_algorithm(folder_path, request.query_params.get('hash_algorithm'))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        file_hash = get_cached_hash(os.path.abspath(file_path), stat, algorithm)
+
+        etag = file_hash or f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        headers = {'ETag': f'"{etag}"'}
+        if file_hash:
+            headers['X-FolderSync-Hash-Algorithm'] = algorithm
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and etag_matches(if_none_match, headers['ETag']):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(file_path, headers=headers, stat_result=stat)
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def progress_event_stream(name):
+    """Yield SSE messages for a channel until a final event is sent
+
+    Polls the channel version every PROGRESS_MIN_INTERVAL instead of waiting
+    on its condition, so an idle subscriber holds no thread.
+    """
+    channel = get_progress_channel(name)
+    with channel['cond']:
+        channel['subscribers'] += 1
+    seen = 0
+    idle = 0.0
+    try:
+        while True:
+            if channel['version'] == seen:
+                await asyncio.sleep(PROGRESS_MIN_INTERVAL)
+                idle += PROGRESS_MIN_INTERVAL
+                if idle >= PROGRESS_KEEPALIVE:
+                    idle = 0.0
+                    yield ': keepalive\n\n'
+                continue
+            with channel['cond']:
+                seen, event, data = channel['version'], channel['event'], channel['data']
+            idle = 0.0
+            yield f"id: {seen}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            if event in PROGRESS_FINAL_EVENTS:
+                return
+            await asyncio.sleep(PROGRESS_MIN_INTERVAL)
+    finally:
+        with channel['cond']:
+            channel['subscribers'] -= 1
+
+def progress_response(name):
+    """Wrap a channel's event stream in a text/event-stream response"""
+    return StreamingResponse(progress_event_stream(name), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def progress_events(request):
+    """SSE progress of an upload or batch download sent with this progress id"""
+    return progress_response(f"progress/{request.path_params['progress_id']}")
+
+async def upload_session_events(request):
+    """SSE stream of bytes received for a resumable upload, ending with 'committed' or 'cancelled'"""
+    upload_id = request.path_params['upload_id']
+    session = await run_io(get_upload_session, upload_id)
+    if session is None:
+        return JSONResponse({'error': 'Upload session not found'}, status_code=404)
+    with session['_lock']:
+        info = session_info(session)
+    if get_progress_channel(f"upload/{upload_id}")['version'] == 0:
+        publish_progress(f"upload/{upload_id}", 'progress', {
+            'received_bytes': info['received_bytes'], 'size': info['size'], 'complete': info['complete']
+        })
+    return progress_response(f"upload/{upload_id}")
+
+async def sync_events(request):
+    """SSE stream of a sync's progress, ending with completed, error or cancelled"""
+    sync_id = request.path_params['sync_id']
+    with sync_lock:
+        if sync_id not in sync_status:
+            return JSONResponse({'error': 'Sync not found'}, status_code=404)
+    if get_progress_channel(f"sync/{sync_id}")['version'] == 0:
+        publish_sync_status(sync_id)
+    return progress_response(f"sync/{sync_id}")
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'sync_base_folder': SYNC_BASE_FOLDER,
+        'hash_algorithms': sorted(HASH_ALGORITHMS),
+        'default_hash_algorithm': DEFAULT_HASH_ALGORITHM,
+        'dedup_mode': DEDUP_MODE,
+        'server': 'asyncio'
+    })
+
+@asynccontextmanager
+async def lifespan(app):
+    start_folder_watcher()
+    yield
+    io_executor.shutdown(wait=False)
+
+app = Starlette(routes=[
+    Route('/api/health', health_check),
+    Route('/api/upload/stream', upload_file_stream, methods=['POST', 'PUT']),
+    Route('/api/upload/sessions/{upload_id}', upload_session_chunk, methods=['PUT']),
+    Route('/api/upload/sessions/{upload_id}/events', upload_session_events),
+    Route('/api/download/{filename:path}', download_file, methods=['GET']),
+    Route('/api/progress/{progress_id}/events', progress_events),
+    Route('/api/sync/events/{sync_id}', sync_events),
+    # Everything else (and other methods on the paths above) is the Flask app
+    Mount('/', app=WSGIMiddleware(sync_server.app, workers=SERVER_THREADS)),
+], lifespan=lifespan)
+
+if __name__ == "__main__":
+    print(f"🚀 Folder Sync Server (asyncio) starting...")
+    print(f"📁 Sync base folder: {SYNC_BASE_FOLDER}")
+    print(f"🌐 Server will be available at: http://localhost:{SERVER_PORT}")
+    print(f"⚡ Transfers on the event loop, file I/O on {IO_WORKERS} threads")
+    uvicorn.run(app, host="0.0.0.0", port=SERVER_PORT, log_level='warning')
@@ -1,7 +1,9 @@
 import os
 import re
 import time
-from flask import Flask, request, send_from_directory, redirect, url_for, flash, render_template_string
+import uuid
+import hashlib
+from flask import Flask, request, send_from_directory, redirect, url_for, flash, render_template_string, jsonify
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
@@ -19,6 +21,7 @@ if not os.path.exists(SHARE_FOLDER):
     os.makedirs(SHARE_FOLDER)
 
 app.config['SHARE_FOLDER'] = SHARE_FOLDER
+PARTIAL_UPLOAD_SUFFIX = '.share-part'  # In-progress raw uploads, hidden from the listing and /clean
 
 def create_safe_filename(filename):
     """
@@ -521,10 +524,64 @@ def index():
             flash("No file part in the request.", "error")
             return '', 400
 
-    files = os.listdir(app.config['SHARE_FOLDER'])
+    files = [name for name in os.listdir(app.config['SHARE_FOLDER']) if not name.endswith(PARTIAL_UPLOAD_SUFFIX)]
     files.sort() 
     return render_template_string(html_template, files=files)
 
+@app.route('/upload-raw', methods=['POST', 'PUT'])
+def upload_raw():
+    """
+    Upload a single file sent as the raw request body (filename in the
+    X-Filename header or ?filename=). Bypasses multipart parsing so the body is
+    written to disk once, hashed on the way, then renamed into place.
+    """
+    original_filename = request.headers.get('X-Filename') or request.args.get('filename', '')
+    if not original_filename:
+        return jsonify({'error': 'X-Filename header or filename parameter is required'}), 400
+
+    filename = create_safe_filename(original_filename)
+    file_path = os.path.join(app.config['SHARE_FOLDER'], filename)
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+
+    part_path = os.path.join(directory, f".{uuid.uuid4().hex}{PARTIAL_UPLOAD_SUFFIX}")
+    try:
+        start_time = time.time()
+        hash_md5 = hashlib.md5()
+        file_size = 0
+        with open(part_path, 'wb') as f:
+            while True:
+                chunk = request.stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+                hash_md5.update(chunk)
+                file_size += len(chunk)
+
+        if request.content_length is not None and file_size != request.content_length:
+            return jsonify({'error': f'Incomplete upload: got {file_size} of {request.content_length} bytes'}), 400
+
+        # Handle duplicate filenames by adding a number
+        counter = 1
+        base_name, extension = os.path.splitext(filename)
+        while os.path.exists(file_path):
+            filename = f"{base_name} ({counter}){extension}"
+            file_path = os.path.join(app.config['SHARE_FOLDER'], filename)
+            counter += 1
+        os.replace(part_path, file_path)
+
+        upload_time = time.time() - start_time
+        speed = file_size / upload_time if upload_time > 0 else 0
+        print(f"✅ Uploaded (raw): {filename} ({file_size} bytes) in {upload_time:.2f}s ({speed/1024:.1f} KB/s)")
+
+        return jsonify({'success': True, 'filename': filename, 'size': file_size, 'md5': hash_md5.hexdigest()})
+    except Exception as e:
+        print(f"❌ Upload error for '{filename}': {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     try:
@@ -538,6 +595,8 @@ def clean():
     success_count = 0
     error_count = 0
     for filename in os.listdir(app.config['SHARE_FOLDER']):
+        if filename.endswith(PARTIAL_UPLOAD_SUFFIX):
+            continue
         file_path = os.path.join(app.config['SHARE_FOLDER'], filename)
         try:
             os.remove(file_path)
@@ -557,12 +616,56 @@ def clean():
 
     return redirect(url_for('index'))
 
-if __name__ == "__main__":
+# Serving - 'auto' prefers gunicorn, whose wsgi.file_wrapper sends /uploads
+# files with os.sendfile, then the Flask dev server. waitress buffers the whole
+# request body before the app runs (so /upload-raw would be written twice),
+# and is only used when SHARE_SERVER=waitress asks for it
+SERVER_MODE = os.environ.get('SHARE_SERVER', 'auto').lower()
+SERVER_WORKERS = min(4, os.cpu_count() or 1)
+SERVER_THREADS = 8
+
+def run_server(host, port):
+    """Serve the app with the best server available for SERVER_MODE"""
+    if SERVER_MODE in ('auto', 'gunicorn'):
+        try:
+            from gunicorn.app.base import BaseApplication
+            
+            class GunicornServer(BaseApplication):
+                def load_config(self):
+                    self.cfg.set('bind', f"{host}:{port}")
+                    self.cfg.set('workers', SERVER_WORKERS)
+                    self.cfg.set('worker_class', 'gthread')
+                    self.cfg.set('threads', SERVER_THREADS)
+                    self.cfg.set('timeout', app.config['UPLOAD_TIMEOUT'])
+                    self.cfg.set('sendfile', True)
+                
+                def load(self):
+                    return app
+            
+            print(f"🦄 Serving with gunicorn ({SERVER_WORKERS} workers x {SERVER_THREADS} threads)")
+            GunicornServer().run()
+            return
+        except ImportError:
+            if SERVER_MODE == 'gunicorn':
+                print("⚠️ gunicorn is not installed, falling back")
+    
+    if SERVER_MODE == 'waitress':
+        try:
+            from waitress import serve
+            print(f"🍽️ Serving with waitress ({SERVER_WORKERS * SERVER_THREADS} threads, request bodies are buffered)")
+            serve(app, host=host, port=port, threads=SERVER_WORKERS * SERVER_THREADS)
+            return
+        except ImportError:
+            print("⚠️ waitress is not installed, falling back")
+    
     # Optimized server settings for better performance
     app.run(
-        host="0.0.0.0", 
-        port=5002, 
+        host=host, 
+        port=port, 
         debug=False,  # Disable debug for better performance
         threaded=True,  # Enable threading for concurrent requests
         use_reloader=False  # Disable auto-reloader for stability
-    )
\ No newline at end of file
+    )
+
+if __name__ == "__main__":
+    run_server("0.0.0.0", 5002)